@@ -0,0 +1,298 @@
+import os
+import re
+import json
+import time
+import random
+import shutil
+import sqlite3
+import resource
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from scraper import SubstackScraper
+
+
+class FakeSubstack:
+    """Local stand-in for a Substack newsletter and its CDN.
+
+    Serves /api/v1/archive, /api/v1/posts/{slug}, /api/v1/posts/{slug}/transcript and image
+    and audio files, with configurable latency, payload sizes and injected 429 responses.
+    Images and audio are linked through "localhost" while the API is "127.0.0.1", so the
+    scraper treats them as separate hosts, like the real newsletter domain and CDN.
+    """
+
+    def __init__(self, posts=200, images_per_post=10, image_bytes=50_000, body_bytes=20_000,
+                 audio_every=0, audio_bytes=2_000_000, latency=0.02, error_rate=0.0, retry_after=1):
+        self.posts = posts
+        self.images_per_post = images_per_post
+        self.image_bytes = image_bytes
+        self.body_bytes = body_bytes
+        self.audio_every = audio_every
+        self.audio_bytes = audio_bytes
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.bytes_sent = 0
+        self.requests = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self.port = None
+
+    @property
+    def api_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def cdn_url(self):
+        return f"http://localhost:{self.port}"
+
+    def _archive_entry(self, i):
+        # Post 0 is the newest
+        day = time.gmtime(time.time() - i * 86400)
+        post = {
+            'id': i,
+            'slug': f"post-{i}",
+            'title': f"Benchmark post {i}",
+            'post_date': time.strftime("%Y-%m-%dT%H:%M:%S.000Z", day),
+            'type': 'newsletter',
+        }
+        if self.audio_every and i % self.audio_every == 0:
+            post['type'] = 'podcast'
+            post['audio_url'] = f"{self.cdn_url}/audio/{i}.mp3"
+        return post
+
+    def _post(self, i):
+        post = self._archive_entry(i)
+        images = "".join(
+            f'<figure><img src="{self.cdn_url}/img/{i}-{n}.jpg" '
+            f'srcset="{self.cdn_url}/img/{i}-{n}.jpg 1456w"></figure>'
+            for n in range(self.images_per_post)
+        )
+        paragraph = f"<p>Paragraph of post {i} with <a href=\"{self.api_url}/p/post-{i + 1}\">a link</a>.</p>"
+        text = paragraph * max(1, self.body_bytes // len(paragraph))
+        post['body_html'] = f"<h2>{post['title']}</h2>{text}{images}"
+        return post
+
+    @staticmethod
+    def _payload(name, size):
+        # Deterministic bytes per name, so identical URLs always return identical content
+        seed = name.encode('utf-8')
+        block = (seed * (4096 // len(seed) + 1))[:4096]
+        return (block * (size // len(block) + 1))[:size]
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=b'', content_type='application/json', headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+                    with fake._lock:
+                        fake.bytes_sent += len(body)
+
+            def _json(self, data):
+                self._send(200, json.dumps(data).encode('utf-8'))
+
+            def _file(self, name, size, content_type):
+                data = fake._payload(name, size)
+                headers = {'Accept-Ranges': 'bytes'}
+                match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+                if match:
+                    start = int(match.group(1))
+                    end = int(match.group(2)) if match.group(2) else len(data) - 1
+                    if start >= len(data):
+                        return self._send(416, headers=headers)
+                    headers['Content-Range'] = f"bytes {start}-{end}/{len(data)}"
+                    return self._send(206, data[start:end + 1], content_type, headers)
+                self._send(200, data, content_type, headers)
+
+            def do_HEAD(self):
+                self.do_GET()
+
+            def do_GET(self):
+                with fake._lock:
+                    fake.requests += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if fake.error_rate and random.random() < fake.error_rate:
+                    with fake._lock:
+                        fake.throttled += 1
+                    return self._send(429, headers={'Retry-After': str(fake.retry_after)})
+
+                url = urlparse(self.path)
+                parts = url.path.strip('/').split('/')
+                if url.path == '/api/v1/archive':
+                    query = parse_qs(url.query)
+                    offset = int(query.get('offset', ['0'])[0])
+                    limit = int(query.get('limit', ['12'])[0])
+                    ids = range(offset, min(offset + limit, fake.posts))
+                    return self._json([fake._archive_entry(i) for i in ids])
+                if parts[:3] == ['api', 'v1', 'posts'] and len(parts) >= 4:
+                    match = re.fullmatch(r'post-(\d+)', parts[3])
+                    if not match or int(match.group(1)) >= fake.posts:
+                        return self._send(404)
+                    i = int(match.group(1))
+                    if len(parts) == 5 and parts[4] == 'transcript':
+                        return self._json({'body_html': f"<p>Transcript of post {i}.</p>" * 50})
+                    return self._json(fake._post(i))
+                if parts[0] == 'img':
+                    return self._file(url.path, fake.image_bytes, 'image/jpeg')
+                if parts[0] == 'audio':
+                    return self._file(url.path, fake.audio_bytes, 'audio/mpeg')
+                self._send(404)
+
+        return Handler
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and its (render) children, in MB."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    scale = 1024 * 1024 if os.uname().sysname == 'Darwin' else 1024
+    return own / scale, children / scale
+
+
+def run_benchmark(args):
+    fake = FakeSubstack(
+        posts=args.posts,
+        images_per_post=args.images,
+        image_bytes=args.image_bytes,
+        body_bytes=args.body_bytes,
+        audio_every=args.audio_every,
+        audio_bytes=args.audio_bytes,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+    ).start()
+
+    output_dir = args.output or tempfile.mkdtemp(prefix="substack-bench-")
+    try:
+        scraper = SubstackScraper(
+            fake.api_url,
+            image_workers=args.image_workers,
+            fetch_workers=args.fetch_workers,
+            asset_workers=args.asset_workers,
+            render_workers=args.render_workers,
+            rate=args.rate,
+            asset_rate=args.rate,
+            raw_cache_dir=os.path.join(output_dir, ".raw"),
+            transport=args.transport,
+        )
+
+        started = time.perf_counter()
+        scraper.scrape(output_dir, limit=args.posts)
+        elapsed = time.perf_counter() - started
+
+        phases = {}
+        if scraper.last_pipeline:
+            for name, stats in scraper.last_pipeline.stats.items():
+                phases[name] = {
+                    'items': stats['items'],
+                    'dropped': stats['dropped'],
+                    'seconds': round(stats['seconds'], 3),
+                    'ms_per_item': round(1000 * stats['seconds'] / stats['items'], 2) if stats['items'] else None,
+                }
+
+        manifest_path = os.path.join(output_dir, "manifest.sqlite3")
+        saved = 0
+        if os.path.exists(manifest_path):
+            with sqlite3.connect(manifest_path) as conn:
+                saved = conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+        metrics = scraper.metrics.report()
+        rss_main, rss_children = peak_rss_mb()
+        return {
+            'posts_saved': saved,
+            'seconds': round(elapsed, 3),
+            'posts_per_sec': round(saved / elapsed, 2) if elapsed else None,
+            'bytes_received': fake.bytes_sent,
+            'mb_per_sec': round(fake.bytes_sent / elapsed / 1e6, 2) if elapsed else None,
+            'requests': fake.requests,
+            'throttled_responses': fake.throttled,
+            'peak_rss_mb': round(rss_main, 1),
+            'peak_child_rss_mb': round(rss_children, 1),
+            'phases': phases,
+            'timings': metrics['phases'],
+            'counters': metrics['counters'],
+        }
+    finally:
+        fake.stop()
+        if not args.output and not args.keep:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def print_report(report):
+    print("\n" + "=" * 50)
+    print(f"Posts saved:      {report['posts_saved']} in {report['seconds']}s ({report['posts_per_sec']} posts/s)")
+    print(f"Bytes received:   {report['bytes_received']:,} ({report['mb_per_sec']} MB/s)")
+    print(f"Requests:         {report['requests']} ({report['throttled_responses']} throttled)")
+    print(f"Peak RSS:         {report['peak_rss_mb']} MB (render processes: {report['peak_child_rss_mb']} MB)")
+    print("Per-phase time (summed across workers):")
+    for name, stats in report['phases'].items():
+        print(f"  {name:<8} {stats['seconds']:>9.3f}s  {stats['items']:>6} items  {stats['ms_per_item']} ms/item")
+    print("Latency by operation (p50 / p95 / max):")
+    for name, stats in report['timings'].items():
+        print(f"  {name:<16} {stats['count']:>6}x  {stats['p50']}s / {stats['p95']}s / {stats['max']}s")
+    print("=" * 50)
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Benchmark the scraper against a local fake Substack (no network access)")
+    parser.add_argument("--posts", type=int, default=200, help="Number of posts in the fake archive (default: 200)")
+    parser.add_argument("--images", type=int, default=10, help="Images per post (default: 10)")
+    parser.add_argument("--image-bytes", type=int, default=50_000, help="Size of each image (default: 50000)")
+    parser.add_argument("--body-bytes", type=int, default=20_000, help="Approximate size of each post body (default: 20000)")
+    parser.add_argument("--audio-every", type=int, default=0, help="Make every Nth post a podcast with audio (default: 0, none)")
+    parser.add_argument("--audio-bytes", type=int, default=2_000_000, help="Size of each audio file (default: 2000000)")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds of latency added to every response (default: 0.02)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 429 (default: 0)")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with injected 429s (default: 1)")
+    parser.add_argument("--rate", type=float, default=1000.0, help="Scraper's starting request rate per host (default: 1000, i.e. unthrottled)")
+    parser.add_argument("--transport", choices=["http1", "http2"], default="http1", help="Scraper transport to benchmark (default: http1)")
+    parser.add_argument("--fetch-workers", type=int, default=4)
+    parser.add_argument("--asset-workers", type=int, default=4)
+    parser.add_argument("--image-workers", type=int, default=8)
+    parser.add_argument("--render-workers", type=int)
+    parser.add_argument("--output", help="Write the archive here instead of a temporary directory")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary archive directory")
+    parser.add_argument("--json", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.json}")
+
+
+if __name__ == "__main__":
+    run()
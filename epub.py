@@ -0,0 +1,269 @@
+"""EPUB export of a newsletter's saved posts, for reading on e-readers.
+
+    from epub import export_epub
+    export_epub("archive/read.substack.com", "https://read.substack.com", split_by_year=True)
+
+Chapters are the rendered .html files and images come from the newsletter's assets/
+directory (or its packed archive), so nothing is downloaded or re-rendered. The book is
+written one post at a time straight into the zip container: only post titles and file names
+are kept in memory, never post bodies or images, so memory stays flat however large the
+archive is. Images are content-addressed, so one shared by many posts is stored once.
+"""
+
+import os
+import uuid
+import zipfile
+import mimetypes
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape, quoteattr
+
+from bs4 import BeautifulSoup
+from tqdm import tqdm
+
+from scraper import Manifest, PackedArchive, HTML_PARSER
+
+# Not every Python version knows these
+MEDIA_TYPES = {'.webp': 'image/webp', '.avif': 'image/avif', '.svg': 'image/svg+xml'}
+
+CONTAINER_XML = """<?xml version="1.0" encoding="utf-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+# E-readers bring their own fonts and margins; only keep images and code in bounds
+EPUB_CSS = """img { max-width: 100%; height: auto; }
+pre { white-space: pre-wrap; }
+blockquote { margin-left: 1em; padding-left: 1em; border-left: 3px solid #ccc; }
+"""
+
+
+def _xhtml(title, body, language):
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+        f'<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang={quoteattr(language)} xml:lang={quoteattr(language)}>\n'
+        f'<head><meta charset="utf-8"/><title>{escape(title)}</title><link rel="stylesheet" type="text/css" href="style.css"/></head>\n'
+        f"<body>\n{body}\n</body>\n</html>\n"
+    )
+
+
+class EpubWriter:
+    """Writes an EPUB 3 book chapter by chapter.
+
+    The mimetype entry goes first and uncompressed, as the format requires. Chapters and
+    images are added to the zip as they arrive; the package document and table of contents,
+    which list them, are written by close(). The book is built under a temporary name and
+    only appears at path once it is complete.
+    """
+
+    def __init__(self, path, title, identifier, language="en"):
+        self.path = path
+        self.title = title
+        self.identifier = identifier
+        self.language = language
+        self._tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._zip = zipfile.ZipFile(self._tmp_path, 'w', compression=zipfile.ZIP_DEFLATED)
+        self._zip.writestr(zipfile.ZipInfo('mimetype'), 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+        self._zip.writestr('META-INF/container.xml', CONTAINER_XML)
+        self._zip.writestr('OEBPS/style.css', EPUB_CSS)
+        # (file name, title) in reading order, and the image file names already stored
+        self.chapters = []
+        self.images = set()
+
+    def add_chapter(self, name, title, body):
+        self._zip.writestr(f"OEBPS/{name}", _xhtml(title, body, self.language))
+        self.chapters.append((name, title))
+
+    def add_image(self, name, path=None, data=None):
+        """Store an image once, from a file (streamed) or bytes. Returns False if it was already stored."""
+        if name in self.images:
+            return False
+        # Images are already compressed; deflating them again only costs time
+        if path:
+            self._zip.write(path, f"OEBPS/images/{name}", compress_type=zipfile.ZIP_STORED)
+        else:
+            self._zip.writestr(f"OEBPS/images/{name}", data, compress_type=zipfile.ZIP_STORED)
+        self.images.add(name)
+        return True
+
+    def close(self):
+        nav_items = "\n".join(
+            f'      <li><a href={quoteattr(name)}>{escape(title)}</a></li>' for name, title in self.chapters
+        )
+        self._zip.writestr('OEBPS/nav.xhtml', _xhtml(
+            self.title,
+            f'<nav epub:type="toc" id="toc"><h1>{escape(self.title)}</h1>\n    <ol>\n{nav_items}\n    </ol>\n</nav>',
+            self.language,
+        ))
+
+        items = [
+            '    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>',
+            '    <item id="style" href="style.css" media-type="text/css"/>',
+        ]
+        spine = []
+        for i, (name, _title) in enumerate(self.chapters):
+            items.append(f'    <item id="c{i}" href={quoteattr(name)} media-type="application/xhtml+xml"/>')
+            spine.append(f'    <itemref idref="c{i}"/>')
+        for i, name in enumerate(sorted(self.images)):
+            ext = os.path.splitext(name)[1].lower()
+            media_type = MEDIA_TYPES.get(ext) or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            items.append(f'    <item id="i{i}" href={quoteattr("images/" + name)} media-type="{media_type}"/>')
+
+        modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        self._zip.writestr('OEBPS/content.opf', "\n".join([
+            '<?xml version="1.0" encoding="utf-8"?>',
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="uid">',
+            '  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">',
+            f'    <dc:identifier id="uid">{escape(self.identifier)}</dc:identifier>',
+            f'    <dc:title>{escape(self.title)}</dc:title>',
+            f'    <dc:language>{escape(self.language)}</dc:language>',
+            f'    <meta property="dcterms:modified">{modified}</meta>',
+            '  </metadata>',
+            '  <manifest>',
+            *items,
+            '  </manifest>',
+            '  <spine>',
+            *spine,
+            '  </spine>',
+            '</package>',
+            '',
+        ]))
+        self._zip.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._zip.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+def _chapter_body(html, chapters, slugs, base_url, add_image):
+    """Turn a rendered post into an XHTML body.
+
+    Local images move to images/, each stored through add_image(name), which returns False
+    if the file is missing; links to posts in the same book point at their chapter, links
+    to other saved posts go back to the web. Audio, remote images and <picture> sources,
+    which an e-reader can't play or fetch, are dropped.
+    """
+    soup = BeautifulSoup(html, HTML_PARSER)
+    body = soup.body or soup
+    for tag in body.find_all(['audio', 'video', 'iframe', 'script', 'style']):
+        tag.decompose()
+    # <source> srcsets point at the CDN. lxml also nests the <img> inside the <source>,
+    # so keep the children and drop the element itself
+    for tag in body.find_all(['source', 'picture']):
+        tag.unwrap()
+
+    for img in body.find_all('img'):
+        src = img.get('src') or ''
+        if not src.startswith('assets/') or not add_image(src[len('assets/'):]):
+            img.decompose()
+            continue
+        img['src'] = f"images/{src[len('assets/'):]}"
+        for attribute in ('srcset', 'sizes'):
+            img.attrs.pop(attribute, None)
+        if not img.get('alt'):
+            img['alt'] = ''
+
+    for a in body.find_all('a', href=True):
+        path, _, fragment = a['href'].partition('#')
+        if not path.endswith('.html') or '/' in path or ':' in path:
+            continue
+        filename_base = path[:-len('.html')]
+        if filename_base in chapters:
+            a['href'] = f"{filename_base}.xhtml" + (f"#{fragment}" if fragment else "")
+        elif filename_base in slugs:
+            a['href'] = f"{base_url}/p/{slugs[filename_base]}"
+
+    return body.decode_contents(formatter='minimal')
+
+
+def _post_html_file(files):
+    for name in files:
+        if name.endswith('.html') and not name.endswith('_transcript.html'):
+            return name
+    return None
+
+
+def export_epub(output_dir, base_url, path=None, since=None, until=None, split_by_year=False, language="en"):
+    """Write the saved posts of output_dir (oldest first) to one EPUB, or one per year. Returns the files written.
+
+    since/until are inclusive 'YYYY-MM-DD' dates. path defaults to <output_dir>.epub; when
+    splitting, the year is added before the extension (read.substack.com-2024.epub).
+    """
+    base_url = base_url.rstrip('/')
+    domain = os.path.basename(os.path.normpath(output_dir))
+    path = path or f"{os.path.normpath(output_dir)}.epub"
+    pack_path = os.path.join(output_dir, PackedArchive.FILENAME)
+    pack = PackedArchive(pack_path) if os.path.exists(pack_path) else None
+    manifest = Manifest(output_dir, pack=pack)
+
+    try:
+        # Titles and file names only; bodies are read one at a time while writing
+        slugs = {base: slug for slug, base in manifest.saved_filename_bases().items()}
+        volumes = {}
+        for post in reversed(manifest.listing()):
+            day = (post['post_date'] or '')[:10]
+            if (since and day < since) or (until and day > until):
+                continue
+            html_file = _post_html_file(post['files'])
+            if not html_file:
+                continue
+            key = (day[:4] or 'undated') if split_by_year else None
+            volumes.setdefault(key, []).append((post, html_file))
+
+        written = []
+        skipped = 0
+        for key, posts in volumes.items():
+            volume_path = f"{os.path.splitext(path)[0]}-{key}.epub" if key else path
+            title = f"{domain} ({key})" if key else domain
+            # Stable per newsletter and volume, so re-exports replace the book on the reader
+            seed = f"{base_url}#{key or since or ''}-{until or ''}"
+            identifier = f"urn:uuid:{uuid.uuid5(uuid.NAMESPACE_URL, seed)}"
+            chapters = {os.path.splitext(html_file)[0] for _post, html_file in posts}
+            book = EpubWriter(volume_path, title, identifier, language=language)
+
+            def add_image(name):
+                if name in book.images:
+                    return True
+                asset = f"assets/{name}"
+                if pack:
+                    data = pack.get(asset)
+                    return data is not None and book.add_image(name, data=data)
+                if os.path.exists(os.path.join(output_dir, asset)):
+                    return book.add_image(name, path=os.path.join(output_dir, asset))
+                return False
+
+            try:
+                for post, html_file in tqdm(posts, desc=os.path.basename(volume_path), unit="posts"):
+                    html = _read(output_dir, pack, html_file)
+                    if html is None:
+                        skipped += 1
+                        continue
+                    body = _chapter_body(html.decode('utf-8'), chapters, slugs, base_url, add_image)
+                    book.add_chapter(os.path.splitext(html_file)[0] + ".xhtml", post['title'] or post['slug'], body)
+            except BaseException:
+                book.abort()
+                raise
+            book.close()
+            written.append(volume_path)
+        if skipped:
+            print(f"Skipped {skipped} posts whose HTML file is missing.")
+        return written
+    finally:
+        manifest.close()
+        if pack:
+            pack.close()
+
+
+def _read(output_dir, pack, name):
+    if pack:
+        return pack.get(name)
+    try:
+        with open(os.path.join(output_dir, name), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
@@ -1,23 +1,1116 @@
 import os
 import time
+import random
+import queue
+import threading
 import json
+import glob
+import gzip
+import zlib
+import hashlib
+import sqlite3
+import shutil
+import re
+import uuid
+import mimetypes
+import cProfile
+import pstats
+import tempfile
 import argparse
+import multiprocessing
+import email.message
 import requests
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from requests.adapters import HTTPAdapter
+from requests.cookies import extract_cookies_to_jar
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers, select_proxy
 from bs4 import BeautifulSoup
+from markdownify import MarkdownConverter
 from tqdm import tqdm
 from dotenv import load_dotenv
 
-from urllib.parse import urlparse, unquote, urljoin
+from datetime import datetime, timezone
+from html import escape as html_escape
+from html.parser import HTMLParser
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse, unquote, urljoin, quote
+from xml.sax.saxutils import escape as xml_escape
 
 load_dotenv()
 
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif')
+AUDIO_EXTENSIONS = ('.mp3', '.m4a', '.wav', '.ogg')
+
+# Audio is only split into parallel byte ranges if each range would be at least this big
+MIN_SEGMENT_BYTES = 4 * 1024 * 1024
+# Seconds without data before a download is considered stalled and resumed
+DOWNLOAD_TIMEOUT = 60
+
+# Archive metadata is spilled to this JSONL file; only these fields are kept in memory
+ARCHIVE_INDEX_FILENAME = "archive_index.jsonl"
+ARCHIVE_FIELDS = ('id', 'slug', 'title', 'post_date', 'updated_at', 'type', 'podcast_url', 'audio_url')
+
+# Optional: Pillow is only needed to transcode images (--image-format)
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Transcoded images start at the first quality and step down until they fit the byte budget
+TRANSCODE_QUALITIES = (82, 72, 62, 52, 42)
+
+# Substack's image CDN resizes on the fly: .../image/fetch/w_1456,c_limit,f_auto,.../<original URL>
+SUBSTACK_CDN_FETCH = "substackcdn.com/image/fetch/"
+
+# Optional: httpx (installed as httpx[http2]) is only needed for the HTTP/2 transport (--transport http2)
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+TRANSPORTS = ('http1', 'http2')
+
+# lxml is several times faster than the built-in parser; use it when it's installed
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+class Metrics:
+    """Thread-safe latency histograms and counters for a single run.
+
+    Phases (archive_page, post_fetch, html_parse, asset_fetch, image_fetch, markdownify,
+    disk_write, ...) get a latency histogram each; everything else (bytes, retries, cache
+    hits, failures) is a plain counter. The result can be written as a JSON report or as a
+    Prometheus textfile for node_exporter's textfile collector.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self.started_at = datetime.now(timezone.utc)
+        self._phases = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, phase):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - started)
+
+    def observe(self, phase, seconds):
+        with self._lock:
+            histogram = self._phases.get(phase)
+            if histogram is None:
+                histogram = {'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * len(self.BUCKETS)}
+                self._phases[phase] = histogram
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            histogram['max'] = max(histogram['max'], seconds)
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+                    break
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def _quantile(self, histogram, q):
+        # Upper bound of the bucket holding the q-th observation
+        target = q * histogram['count']
+        seen = 0
+        for bound, count in zip(self.BUCKETS, histogram['buckets']):
+            seen += count
+            if seen >= target:
+                # The bucket bound can overshoot; nothing was slower than the max
+                return min(bound, round(histogram['max'], 4))
+        return round(histogram['max'], 4)
+
+    def report(self, **extra):
+        """Return the run's metrics as a JSON-serializable dict."""
+        with self._lock:
+            phases = {}
+            for phase, histogram in sorted(self._phases.items()):
+                phases[phase] = {
+                    'count': histogram['count'],
+                    'seconds': round(histogram['sum'], 4),
+                    'mean': round(histogram['sum'] / histogram['count'], 4) if histogram['count'] else None,
+                    'p50': self._quantile(histogram, 0.5),
+                    'p95': self._quantile(histogram, 0.95),
+                    'max': round(histogram['max'], 4),
+                    'buckets': dict(zip([str(bound) for bound in self.BUCKETS], histogram['buckets'])),
+                }
+            counters = dict(sorted(self._counters.items()))
+        report = {
+            'started_at': self.started_at.isoformat(),
+            'finished_at': datetime.now(timezone.utc).isoformat(),
+            'phases': phases,
+            'counters': counters,
+        }
+        report.update(extra)
+        return report
+
+    def write_json(self, path, **extra):
+        _write_atomically(path, json.dumps(self.report(**extra), indent=2))
+
+    def write_prometheus(self, path, labels=None):
+        """Write the metrics in Prometheus text exposition format."""
+        base_labels = "".join(f',{key}="{value}"' for key, value in (labels or {}).items())
+        lines = [
+            "# HELP substack_phase_seconds Time spent per phase of a scraper run.",
+            "# TYPE substack_phase_seconds histogram",
+        ]
+        with self._lock:
+            for phase, histogram in sorted(self._phases.items()):
+                cumulative = 0
+                for bound, count in zip(self.BUCKETS, histogram['buckets']):
+                    cumulative += count
+                    lines.append(f'substack_phase_seconds_bucket{{phase="{phase}"{base_labels},le="{bound}"}} {cumulative}')
+                lines.append(f'substack_phase_seconds_bucket{{phase="{phase}"{base_labels},le="+Inf"}} {histogram["count"]}')
+                lines.append(f'substack_phase_seconds_sum{{phase="{phase}"{base_labels}}} {histogram["sum"]:.6f}')
+                lines.append(f'substack_phase_seconds_count{{phase="{phase}"{base_labels}}} {histogram["count"]}')
+
+            lines.append("# HELP substack_events_total Counters (bytes, retries, cache hits, failures) for a scraper run.")
+            lines.append("# TYPE substack_events_total counter")
+            for name, value in sorted(self._counters.items()):
+                lines.append(f'substack_events_total{{event="{name}"{base_labels}}} {value}')
+
+        lines.append("# HELP substack_run_timestamp_seconds When the run finished.")
+        lines.append("# TYPE substack_run_timestamp_seconds gauge")
+        lines.append(f'substack_run_timestamp_seconds{{{base_labels.lstrip(",")}}} {time.time():.0f}')
+        _write_atomically(path, "\n".join(lines) + "\n")
+
+
+def _write_atomically(path, text):
+    # Readers (and the textfile collector) must never see a half-written file
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class RateLimiter:
+    """Adaptive per-host token bucket shared by every request a scraper makes.
+
+    Each host starts at its configured rate. A throttled response (429/503) halves the
+    rate, at most once per cooldown window (the Retry-After or backoff delay, and at least
+    throttle_cooldown seconds): workers in flight together see the same burst of 429s, and
+    that is one signal, not one per worker. Retry-After also pauses the whole host until then.
+    After a run of clean responses the rate creeps back up, up to ramp_factor times the start rate.
+
+    Hosts can also have a cap on requests in flight at once (host_concurrency, falling
+    back to max_concurrency; None means no cap).
+    """
+
+    def __init__(self, rate=2.0, host_rates=None, min_rate=0.5, ramp_factor=5.0, clean_streak=10,
+                 max_concurrency=None, host_concurrency=None, throttle_cooldown=1.0):
+        self.rate = rate
+        self.throttle_cooldown = throttle_cooldown
+        self.host_rates = host_rates or {}
+        self.min_rate = min_rate
+        self.ramp_factor = ramp_factor
+        self.clean_streak = clean_streak
+        self.max_concurrency = max_concurrency
+        self.host_concurrency = host_concurrency or {}
+        self._buckets = {}
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def set_host_limits(self, host, rate=None, concurrency=None):
+        """Configure a host's starting rate and/or concurrency cap before its first request."""
+        with self._lock:
+            if rate is not None:
+                self.host_rates[host] = rate
+            if concurrency is not None:
+                self.host_concurrency[host] = concurrency
+
+    @contextmanager
+    def slot(self, host):
+        """Hold one of the host's in-flight request slots, if it has a cap."""
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                limit = self.host_concurrency.get(host, self.max_concurrency)
+                semaphore = threading.BoundedSemaphore(limit) if limit else False
+                self._semaphores[host] = semaphore
+        if not semaphore:
+            yield
+            return
+        with semaphore:
+            yield
+
+    def _bucket(self, host):
+        # Callers must hold self._lock
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            rate = self.host_rates.get(host, self.rate)
+            bucket = {
+                'rate': rate,
+                'max_rate': rate * self.ramp_factor,
+                'tokens': 1.0,
+                'updated': time.monotonic(),
+                'blocked_until': 0.0,
+                'clean': 0,
+                # When the rate was last halved, and how long further throttles are ignored for
+                'last_throttle': None,
+                'cooldown': 0.0,
+            }
+            self._buckets[host] = bucket
+        return bucket
+
+    def acquire(self, host):
+        """Block until a request to host is allowed."""
+        while True:
+            with self._lock:
+                bucket = self._bucket(host)
+                now = time.monotonic()
+                if now < bucket['blocked_until']:
+                    wait = bucket['blocked_until'] - now
+                else:
+                    # Refill, allowing a burst of at most one second's worth of requests
+                    elapsed = now - bucket['updated']
+                    bucket['tokens'] = min(max(1.0, bucket['rate']), bucket['tokens'] + elapsed * bucket['rate'])
+                    bucket['updated'] = now
+                    if bucket['tokens'] >= 1.0:
+                        bucket['tokens'] -= 1.0
+                        return
+                    wait = (1.0 - bucket['tokens']) / bucket['rate']
+            time.sleep(wait)
+
+    def on_success(self, host):
+        """Record a clean response and speed back up after enough of them."""
+        with self._lock:
+            bucket = self._bucket(host)
+            bucket['clean'] += 1
+            if bucket['clean'] >= self.clean_streak:
+                bucket['clean'] = 0
+                bucket['rate'] = min(bucket['max_rate'], bucket['rate'] * 1.25)
+
+    def on_throttle(self, host, retry_after=None):
+        """Slow a host down after the server pushed back."""
+        with self._lock:
+            bucket = self._bucket(host)
+            now = time.monotonic()
+            bucket['clean'] = 0
+            if bucket['last_throttle'] is None or now >= bucket['last_throttle'] + bucket['cooldown']:
+                bucket['rate'] = max(self.min_rate, bucket['rate'] / 2)
+                bucket['last_throttle'] = now
+                bucket['cooldown'] = max(self.throttle_cooldown, retry_after or 0.0)
+            bucket['tokens'] = 0.0
+            if retry_after:
+                bucket['blocked_until'] = max(bucket['blocked_until'], now + retry_after)
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """HTTP adapter that waits on a RateLimiter before each request and retries throttled or failed ones.
+
+    If accept_encoding is set, it replaces the session's Accept-Encoding header: media
+    adapters ask for 'identity', since images and audio are already compressed and Range
+    resumes must address the stored bytes.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    THROTTLE_STATUSES = (429, 503)
+
+    def __init__(self, limiter, retries=5, backoff=1.0, max_backoff=120.0, metrics=None, accept_encoding=None, **kwargs):
+        self.limiter = limiter
+        self.metrics = metrics
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.accept_encoding = accept_encoding
+        super().__init__(**kwargs)
+
+    def _send_once(self, request, **kwargs):
+        # The transfer itself; HTTP2Adapter swaps in httpx here and keeps the retry loop
+        return super().send(request, **kwargs)
+
+    def _retry_after(self, response):
+        """Parse a Retry-After header (seconds or HTTP date) into a delay in seconds."""
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                return None
+        return min(max(delay, 0.0), self.max_backoff)
+
+    def _backoff_delay(self, attempt):
+        # Exponential backoff with jitter so parallel workers don't retry in lockstep
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    def send(self, request, **kwargs):
+        host = urlparse(request.url).netloc
+        if self.accept_encoding:
+            request.headers['Accept-Encoding'] = self.accept_encoding
+        attempt = 0
+        while True:
+            self.limiter.acquire(host)
+            try:
+                # For streamed downloads the slot covers the response headers, not the whole body
+                with self.limiter.slot(host):
+                    response = self._send_once(request, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if self.metrics:
+                    self.metrics.incr('connection_errors')
+                if attempt >= self.retries:
+                    raise
+                if self.metrics:
+                    self.metrics.incr('retries')
+                time.sleep(self._backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code not in self.RETRY_STATUSES:
+                self.limiter.on_success(host)
+                return response
+            if attempt >= self.retries:
+                return response
+
+            retry_after = self._retry_after(response)
+            delay = retry_after if retry_after is not None else self._backoff_delay(attempt)
+            if self.metrics:
+                self.metrics.incr('retries')
+                self.metrics.incr(f"http_{response.status_code}")
+            if response.status_code in self.THROTTLE_STATUSES:
+                # Pause every worker talking to this host, not just this one
+                self.limiter.on_throttle(host, retry_after=delay)
+            else:
+                time.sleep(delay)
+            response.close()
+            attempt += 1
+
+
+class _HTTPXBody:
+    """The body of a streamed httpx response, shaped like the urllib3 response requests reads from."""
+
+    def __init__(self, response):
+        self._response = response
+        self._chunks = None
+        self._buffer = b''
+        # Lets requests copy Set-Cookie headers into the session's cookie jar
+        self._original_response = _HTTPXHeaders(response)
+
+    def _next_chunk(self, chunk_size):
+        if self._chunks is None:
+            self._chunks = self._response.iter_bytes(chunk_size)
+        try:
+            return next(self._chunks, None)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.ReadTimeout(e)
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(e)
+
+    def stream(self, chunk_size=None, decode_content=True):
+        if self._buffer:
+            buffered, self._buffer = self._buffer, b''
+            yield buffered
+        while True:
+            chunk = self._next_chunk(chunk_size)
+            if chunk is None:
+                return
+            yield chunk
+
+    def read(self, amt=None):
+        data, self._buffer = self._buffer, b''
+        while amt is None or len(data) < amt:
+            chunk = self._next_chunk(amt)
+            if chunk is None:
+                break
+            data += chunk
+        if amt is not None:
+            data, self._buffer = data[:amt], data[amt:]
+        return data
+
+    def close(self):
+        self._response.close()
+
+    def release_conn(self):
+        self.close()
+
+
+class _HTTPXHeaders:
+    # requests.cookies only needs .msg.get_all() from the original http.client response
+    def __init__(self, response):
+        self.msg = email.message.Message()
+        for key, value in response.headers.multi_items():
+            self.msg[key] = value
+
+
+class HTTP2Adapter(RateLimitedAdapter):
+    """RateLimitedAdapter that transfers requests with httpx over HTTP/2.
+
+    Concurrent requests to one host share a connection as multiplexed streams, instead
+    of opening a connection per request in flight. The requests Session still prepares
+    every request (headers, cookies, redirects) and gets Set-Cookie back, and the retry
+    loop and rate limiter are unchanged: only the transfer goes through httpx. Servers
+    without HTTP/2, and plain http:// URLs, get HTTP/1.1 keep-alive connections.
+
+    The session's verify, cert and proxy settings (including REQUESTS_CA_BUNDLE and the
+    *_PROXY variables, which requests merges in) are honoured: each combination gets its
+    own httpx client, since httpx fixes them per client rather than per request.
+    """
+
+    def __init__(self, limiter, pool_maxsize=10, **kwargs):
+        super().__init__(limiter, pool_maxsize=pool_maxsize, **kwargs)
+        self._pool_maxsize = pool_maxsize
+        self._clients_lock = threading.Lock()
+        self._clients = {}
+        # Created up front so a missing h2 package shows up here, where make_adapter catches it
+        self._get_client(True, None, None)
+
+    def _get_client(self, verify, cert, proxy):
+        key = (verify, tuple(cert) if isinstance(cert, list) else cert, proxy)
+        with self._clients_lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._clients[key] = httpx.Client(
+                    http2=True,
+                    verify=verify,
+                    cert=key[1],
+                    proxy=proxy,
+                    # requests has already applied the environment; don't let httpx do it again
+                    trust_env=False,
+                    limits=httpx.Limits(max_connections=self._pool_maxsize, max_keepalive_connections=self._pool_maxsize),
+                )
+            return client
+
+    @staticmethod
+    def _timeout(timeout):
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            return httpx.Timeout(read, connect=connect).as_dict()
+        return httpx.Timeout(timeout).as_dict()
+
+    def _send_once(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        body = request.body.encode('utf-8') if isinstance(request.body, str) else request.body
+        # Built directly (not with client.build_request) so httpx's own cookie jar is never sent
+        outgoing = httpx.Request(
+            request.method,
+            request.url,
+            headers=list(request.headers.items()),
+            content=body,
+            extensions={'timeout': self._timeout(timeout)},
+        )
+        client = self._get_client(verify, cert, select_proxy(request.url, proxies or {}))
+        try:
+            incoming = client.send(outgoing, stream=True)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(e, request=request)
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(e, request=request)
+        if self.metrics and incoming.http_version == "HTTP/2":
+            self.metrics.incr('http2_responses')
+
+        response = requests.Response()
+        response.status_code = incoming.status_code
+        headers = CaseInsensitiveDict()
+        for key, value in incoming.headers.multi_items():
+            headers[key] = f"{headers[key]}, {value}" if key in headers else value
+        response.headers = headers
+        response.encoding = get_encoding_from_headers(headers)
+        response.reason = incoming.reason_phrase
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.raw = _HTTPXBody(incoming)
+        extract_cookies_to_jar(response.cookies, request, response.raw)
+        if not stream:
+            response.content
+        return response
+
+    def close(self):
+        with self._clients_lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+        super().close()
+
+
+def make_adapter(transport, limiter, retries=5, metrics=None, pool_connections=10, pool_maxsize=10, accept_encoding=None):
+    """A rate-limited adapter for one of TRANSPORTS, with a keep-alive pool of pool_maxsize connections per host."""
+    if transport == 'http2':
+        if httpx is not None:
+            try:
+                return HTTP2Adapter(limiter, retries=retries, metrics=metrics, pool_connections=pool_connections,
+                                    pool_maxsize=pool_maxsize, accept_encoding=accept_encoding)
+            except ImportError:
+                # httpx is installed without the h2 package
+                pass
+        print("HTTP/2 needs httpx with HTTP/2 support (pip install 'httpx[http2]'); using HTTP/1.1.")
+    return RateLimitedAdapter(limiter, retries=retries, metrics=metrics, pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize, accept_encoding=accept_encoding)
+
+
+class AssetIndex:
+    """URL -> filename index (index.jsonl) of one asset store directory, plus per-URL download locks.
+
+    A batch run gives every newsletter sharing a store directory the same AssetIndex, so an
+    image one newsletter is downloading (or has downloaded) is never fetched again by another.
+    """
+
+    FILENAME = "index.jsonl"
+
+    def __init__(self, store_dir):
+        self.path = os.path.join(store_dir, self.FILENAME)
+        self._files = {}
+        self._lock = threading.Lock()
+        self._url_locks = {}
+
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A crash can leave a half-written last line behind
+                        continue
+                    self._files[entry['url']] = entry['file']
+
+    def url_lock(self, url):
+        # Two posts embedding the same image must not download it twice at the same time
+        with self._lock:
+            return self._url_locks.setdefault(url, threading.Lock())
+
+    def get(self, url):
+        return self._files.get(url)
+
+    def add(self, url, filename):
+        with self._lock:
+            if self._files.get(url) == filename:
+                return
+            self._files[url] = filename
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'url': url, 'file': filename}) + "\n")
+
+
+class AssetStore:
+    """Content-addressed store for downloaded images and audio.
+
+    Files are named after the SHA-256 of their bytes, so the same image served from
+    different URLs is stored once and different images that share a basename never
+    collide. An append-only index (index.jsonl) maps each source URL to its file, which
+    makes lookups a dict access instead of a directory scan.
+
+    When a shared store directory is given, files live there and are hard-linked (or
+    copied, if linking isn't possible) into each newsletter's assets directory, so an
+    image used by several newsletters is downloaded only once. Scrapers running at the same
+    time should pass the same AssetIndex for it, so they also see each other's downloads.
+    """
+
+    INDEX_FILENAME = AssetIndex.FILENAME
+
+    def __init__(self, assets_dir, shared_dir=None, metrics=None, pack=None, index=None):
+        self.metrics = metrics
+        # With a PackedArchive, files end up in the pack as assets/<file> instead of the assets directory
+        self.pack = pack
+        self.assets_dir = assets_dir
+        self.store_dir = shared_dir or assets_dir
+        os.makedirs(self.assets_dir, exist_ok=True)
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.index = index or AssetIndex(self.store_dir)
+
+    def url_lock(self, url):
+        return self.index.url_lock(url)
+
+    def _count(self, name, value=1):
+        if self.metrics:
+            self.metrics.incr(name, value)
+
+    def _stored(self, filename):
+        if self.pack and self.store_dir == self.assets_dir:
+            return self.pack.exists(f"assets/{filename}")
+        return os.path.exists(os.path.join(self.store_dir, filename))
+
+    def _link_into_assets(self, filename):
+        if self.pack:
+            if self.store_dir != self.assets_dir and not self.pack.exists(f"assets/{filename}"):
+                self.pack.put_file(f"assets/{filename}", os.path.join(self.store_dir, filename))
+            return
+        if self.store_dir == self.assets_dir:
+            return
+        local_path = os.path.join(self.assets_dir, filename)
+        if os.path.exists(local_path):
+            return
+        try:
+            os.link(os.path.join(self.store_dir, filename), local_path)
+        except FileExistsError:
+            pass
+        except OSError:
+            shutil.copyfile(os.path.join(self.store_dir, filename), local_path)
+
+    def has(self, filename):
+        """True if a stored file is (or can be linked) into the assets directory."""
+        if self._stored(filename):
+            self._link_into_assets(filename)
+            return True
+        if self.pack:
+            return self.pack.exists(f"assets/{filename}")
+        return os.path.exists(os.path.join(self.assets_dir, filename))
+
+    def lookup(self, url):
+        """Return the stored filename for a URL if it was downloaded before, else None."""
+        filename = self.index.get(url)
+        if filename and self._stored(filename):
+            self._link_into_assets(filename)
+            return filename
+        return None
+
+    @staticmethod
+    def extension_for(url, content_type, allowed, default):
+        """Pick a file extension from the URL path, falling back to the Content-Type."""
+        # Substack CDN URLs wrap the original URL, so decode before looking at the basename
+        ext = os.path.splitext(unquote(urlparse(url).path))[1].lower()
+        if ext in allowed:
+            return ext
+        if content_type:
+            ext = mimetypes.guess_extension(content_type.split(';')[0].strip())
+            if ext in allowed:
+                return ext
+        return default
+
+    def add_file(self, url, path, ext):
+        """Move an already-downloaded file into the store under its content hash and index it."""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return self._commit(url, path, digest.hexdigest(), ext)
+
+    def part_path(self, url):
+        """Stable scratch path for a partial download of url, so a later run can resume it."""
+        return os.path.join(self.store_dir, f".{hashlib.sha1(url.encode('utf-8')).hexdigest()}.part")
+
+    def _commit(self, url, tmp_path, hexdigest, ext):
+        filename = f"{hexdigest[:32]}{ext}"
+        final_path = os.path.join(self.store_dir, filename)
+        if self.pack and self.store_dir == self.assets_dir:
+            if not self.pack.exists(f"assets/{filename}"):
+                self.pack.put_file(f"assets/{filename}", tmp_path)
+            os.remove(tmp_path)
+        elif os.path.exists(final_path):
+            # Same bytes as something we already have
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, final_path)
+
+        self.index.add(url, filename)
+
+        self._link_into_assets(filename)
+        return filename
+
+    def fetch(self, session, url, allowed_extensions, default_extension, key=None, transform=None):
+        """Return the local filename for url, downloading and hashing it as it streams if needed.
+
+        A transform(path, ext) -> (path, ext) callback can replace the downloaded file before
+        it is stored (e.g. a transcoded image); the result is indexed under key instead of url.
+        """
+        key = key or url
+        filename = self.lookup(key)
+        if filename:
+            self._count('asset_cache_hits')
+            return filename
+
+        with self.url_lock(key):
+            # Another worker may have finished this URL while we waited for the lock
+            filename = self.lookup(key)
+            if filename:
+                self._count('asset_cache_hits')
+                return filename
+
+            response = session.get(url, stream=True)
+            response.raise_for_status()
+            ext = self.extension_for(url, response.headers.get('Content-Type'), allowed_extensions, default_extension)
+
+            digest = hashlib.sha256()
+            tmp_path = os.path.join(self.store_dir, f".tmp-{uuid.uuid4().hex}")
+            try:
+                with open(tmp_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=65536):
+                        digest.update(chunk)
+                        f.write(chunk)
+                        self._count('bytes_assets', len(chunk))
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+            if transform:
+                transformed_path, transformed_ext = transform(tmp_path, ext)
+                if transformed_path != tmp_path:
+                    os.remove(tmp_path)
+                    return self.add_file(key, transformed_path, transformed_ext)
+            return self._commit(key, tmp_path, digest.hexdigest(), ext)
+
+
+class RawCache:
+    """Gzip-compressed copies of raw API responses, so posts can be re-rendered without the network.
+
+    Responses are grouped by kind ('archive', 'posts', 'transcripts') and stored one per
+    file as <root>/<kind>/<key>.json.gz, or as entries of the same name in a PackedArchive.
+    """
+
+    def __init__(self, root, pack=None):
+        self.root = root
+        self.pack = pack
+
+    def _safe_key(self, key):
+        return "".join(c if c.isalnum() or c in ('-', '_', '.') else '_' for c in str(key))
+
+    def _path(self, kind, key):
+        return os.path.join(self.root, kind, f"{self._safe_key(key)}.json.gz")
+
+    def _pack_name(self, kind, key=''):
+        prefix = f"{os.path.basename(os.path.normpath(self.root))}/{kind}/"
+        return f"{prefix}{self._safe_key(key)}.json.gz" if key != '' else prefix
+
+    def put(self, kind, key, data):
+        if self.pack:
+            self.pack.put(self._pack_name(kind, key), gzip.compress(json.dumps(data).encode('utf-8')))
+            return
+        path = self._path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so a crash never leaves a truncated entry behind
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def get(self, kind, key):
+        if self.pack:
+            data = self.pack.get(self._pack_name(kind, key))
+            return json.loads(gzip.decompress(data)) if data is not None else None
+        path = self._path(kind, key)
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    def keys(self, kind):
+        if self.pack:
+            prefix = self._pack_name(kind)
+            return [name[len(prefix):-len('.json.gz')] for name in self.pack.names(prefix)]
+        directory = os.path.join(self.root, kind)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name[:-len('.json.gz')] for name in os.listdir(directory) if name.endswith('.json.gz'))
+
+
+class PackedArchive:
+    """Single-file SQLite container standing in for a newsletter's output directory.
+
+    Entries are named by the path they would have relative to the output directory
+    ('2024-01-01_some-post.md', 'assets/3f2a...e1.jpg', '.raw/posts/some-post.json.gz'), so
+    export() recreates exactly the usual layout. Text is zlib-compressed; images, audio
+    and gzip files are stored as they are. Small writes are buffered and committed in
+    batches; whole files (images, audio) go straight in, streamed in chunks so a podcast
+    episode is never held in memory.
+
+    Anything still buffered when a run crashes is simply missing from the pack, so the
+    manifest no longer sees those posts as saved and the next run fetches them again.
+    """
+
+    FILENAME = "archive.pack.sqlite3"
+    BATCH_FILES = 256
+    BATCH_BYTES = 8 * 1024 * 1024
+    CHUNK_BYTES = 1024 * 1024
+    COMPRESSED_EXTENSIONS = ('.html', '.md', '.json', '.jsonl', '.txt', '.xml')
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.RLock()
+        # Render processes open the same pack to read; give writers time instead of failing
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                name TEXT PRIMARY KEY,
+                data BLOB,
+                size INTEGER,
+                compressed INTEGER,
+                mtime TEXT
+            )
+        """)
+        self._conn.commit()
+        self._names = {row[0] for row in self._conn.execute("SELECT name FROM files")}
+        self._pending = {}
+        self._pending_bytes = 0
+
+    def _encode(self, name, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if name.endswith(self.COMPRESSED_EXTENSIONS):
+            return zlib.compress(data, 6), len(data), 1
+        return data, len(data), 0
+
+    def exists(self, name):
+        with self._lock:
+            return name in self._names
+
+    def names(self, prefix=''):
+        with self._lock:
+            return sorted(name for name in self._names if name.startswith(prefix))
+
+    def put(self, name, data):
+        """Buffer a small file (str or bytes); it is committed with the next batch."""
+        blob, size, compressed = self._encode(name, data)
+        with self._lock:
+            self._pending[name] = (blob, size, compressed)
+            self._pending_bytes += len(blob)
+            self._names.add(name)
+            if len(self._pending) >= self.BATCH_FILES or self._pending_bytes >= self.BATCH_BYTES:
+                self.flush()
+
+    def put_file(self, name, path):
+        """Store a file from disk right away (used for downloaded images and audio)."""
+        mtime = datetime.now(timezone.utc).isoformat()
+        # Connection.blobopen (incremental blob I/O) needs Python 3.11
+        if name.endswith(self.COMPRESSED_EXTENSIONS) or not hasattr(self._conn, 'blobopen'):
+            with open(path, 'rb') as f:
+                blob, size, compressed = self._encode(name, f.read())
+            with self._lock:
+                self._conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", (name, blob, size, compressed, mtime))
+                self._conn.commit()
+                self._names.add(name)
+            return
+
+        size = os.path.getsize(path)
+        with self._lock:
+            try:
+                # Reserve the space, then copy the file into it a chunk at a time
+                cursor = self._conn.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, zeroblob(?), ?, 0, ?)", (name, size, size, mtime)
+                )
+                with self._conn.blobopen('files', 'data', cursor.lastrowid) as blob, open(path, 'rb') as f:
+                    while True:
+                        chunk = f.read(self.CHUNK_BYTES)
+                        if not chunk:
+                            break
+                        blob.write(chunk)
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._names.add(name)
+
+    def get(self, name):
+        """Return a file's contents as bytes, or None if it isn't in the pack."""
+        with self._lock:
+            if name in self._pending:
+                blob, _size, compressed = self._pending[name]
+            else:
+                row = self._conn.execute("SELECT data, compressed FROM files WHERE name = ?", (name,)).fetchone()
+                if row is None:
+                    return None
+                blob, compressed = row
+        return zlib.decompress(blob) if compressed else bytes(blob)
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            mtime = datetime.now(timezone.utc).isoformat()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                [(name, blob, size, compressed, mtime) for name, (blob, size, compressed) in self._pending.items()],
+            )
+            self._conn.commit()
+            self._pending = {}
+            self._pending_bytes = 0
+
+    def export(self, target_dir, prefix=''):
+        """Write every file (or those under prefix) out to target_dir in the usual layout. Returns the count."""
+        self.flush()
+        count = 0
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT rowid, name, compressed FROM files WHERE name >= ? ORDER BY name", (prefix,)
+            ).fetchall()
+            for rowid, name, compressed in rows:
+                if not name.startswith(prefix):
+                    break
+                path = os.path.join(target_dir, *name.split('/'))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    if compressed or not hasattr(self._conn, 'blobopen'):
+                        f.write(self.get(name))
+                    else:
+                        # Stored files (audio can be 100+ MB) are copied out a chunk at a time
+                        with self._conn.blobopen('files', 'data', rowid, readonly=True) as blob:
+                            while True:
+                                chunk = blob.read(self.CHUNK_BYTES)
+                                if not chunk:
+                                    break
+                                f.write(chunk)
+                os.replace(tmp_path, path)
+                count += 1
+        return count
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._conn.close()
+
+
+class SharedResources:
+    """Rate limiter, connection pool and worker pools shared by every scraper in a batch run.
+
+    Images for every newsletter come from the same CDN host, so one adapter (and so one
+    urllib3 pool per host) serves them all, and one image executor and render process pool
+    bound the total work in flight. Cookies stay on each scraper's own session.
+    """
+
+    def __init__(self, image_workers=16, render_workers=None, asset_rate=20.0, retries=5,
+                 asset_concurrency=None, hosts=8, search_index=None, transport='http1'):
+        self.metrics = Metrics()
+        self.search_index = search_index
+        self.transport = transport
+        self.retries = retries
+        self.render_workers = max(1, render_workers or os.cpu_count() or 1)
+        self.rate_limiter = RateLimiter(rate=asset_rate, max_concurrency=asset_concurrency)
+        # Images and audio for every newsletter; each scraper mounts its own adapter for its API host
+        self.adapter = make_adapter(
+            transport,
+            self.rate_limiter,
+            retries=retries,
+            metrics=self.metrics,
+            # One pool per CDN or custom image host
+            pool_connections=hosts + 4,
+            pool_maxsize=image_workers + 8,
+            accept_encoding='identity',
+        )
+        self.image_executor = ThreadPoolExecutor(max_workers=max(1, image_workers))
+        self.render_pool = _process_pool(self.render_workers)
+        # One AssetIndex per shared asset store directory, used by every newsletter writing to it
+        self._asset_indexes = {}
+        self._asset_indexes_lock = threading.Lock()
+
+    def asset_index(self, store_dir):
+        """The AssetIndex every scraper in the batch uses for store_dir."""
+        key = os.path.abspath(store_dir)
+        with self._asset_indexes_lock:
+            index = self._asset_indexes.get(key)
+            if index is None:
+                os.makedirs(store_dir, exist_ok=True)
+                index = self._asset_indexes[key] = AssetIndex(store_dir)
+            return index
+
+    def close(self):
+        self.image_executor.shutdown()
+        self.render_pool.shutdown()
+        self.adapter.close()
+        if self.search_index:
+            self.search_index.close()
+
+
 class SubstackScraper:
-    def __init__(self, base_url, cookie=None):
+    def __init__(self, base_url, cookie=None, image_workers=8, fetch_workers=4, asset_workers=4, render_workers=None, queue_size=8, rate=2.0, asset_rate=20.0, retries=5, asset_store_dir=None, raw_cache_dir=None, audio_segments=1, profile_path=None, shared=None, concurrency=None, search_index=None, pack_path=None,
+                 image_width=None, image_format=None, image_max_bytes=None, transcode_workers=None, transport='http1',
+                 library_root=None):
         self.base_url = base_url.rstrip('/')
+        # Archive directory whose index.html lists every newsletter; only the CLI and batch runs own one
+        self.library_root = library_root
+        self.domain = urlparse(self.base_url).netloc
+        self.image_workers = max(1, image_workers)
+        self.fetch_workers = max(1, fetch_workers)
+        self.asset_workers = max(1, asset_workers)
+        # Render workers are processes, so default to one per core
+        self.render_workers = max(1, render_workers or os.cpu_count() or 1)
+        self.queue_size = max(1, queue_size)
+        # The most recent download Pipeline, kept for its per-stage stats
+        self.last_pipeline = None
+        # Shown on the progress bar; batch runs set it so each newsletter gets its own line
+        self.progress_label = None
+        self.progress_position = None
+        self.shared = shared
+        self.metrics = shared.metrics if shared else Metrics()
+        # Posts are added to this SearchIndex (if set) as they are written
+        self.search_index = search_index
+        # If set, the render path is run under cProfile and the merged stats are written here
+        self.profile_path = profile_path
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
         })
+        self.asset_store_dir = asset_store_dir
+        self.audio_segments = max(1, audio_segments)
+        self.retries = retries
+        # Images are fetched at (about) this width, and optionally re-encoded as WebP/AVIF in a process pool
+        self.image_width = image_width
+        self.image_format = image_format
+        if image_format and Image is None:
+            print("Pillow is not installed (pip install Pillow); images will be kept in their original format.")
+            self.image_format = None
+        self.image_max_bytes = image_max_bytes
+        self.transcode_workers = max(1, transcode_workers or os.cpu_count() or 1)
+        self._transcode_pool = None
+        # Posts, assets and raw responses go into this single-file container instead of loose files, if set
+        self.pack = PackedArchive(pack_path) if pack_path else None
+        # Raw API responses are kept here (if set) so the archive can be re-rendered offline
+        self.raw_cache = RawCache(raw_cache_dir, pack=self.pack) if raw_cache_dir else None
+        self._asset_stores = {}
+        self._asset_stores_lock = threading.Lock()
+        self._image_executor = shared.image_executor if shared else None
+        self._image_executor_lock = threading.Lock()
+        self.transport = shared.transport if shared else transport
+        if shared:
+            # Batch run: this newsletter's API host gets its own rate and concurrency cap
+            # in the shared limiter, and media goes through the shared connection pools
+            self.rate_limiter = shared.rate_limiter
+            self.rate_limiter.set_host_limits(urlparse(self.base_url).netloc, rate=rate, concurrency=concurrency)
+            media_adapter = shared.adapter
+        else:
+            # Every request (archive, posts, transcripts, images, audio) goes through one rate limiter.
+            # The newsletter's API gets its own, slower starting rate; CDN hosts use asset_rate.
+            self.rate_limiter = RateLimiter(
+                rate=asset_rate,
+                host_rates={urlparse(self.base_url).netloc: rate},
+                host_concurrency={urlparse(self.base_url).netloc: concurrency} if concurrency else None,
+            )
+            # Image workers (and audio segments) all hit the same CDN host, so size its pool to match.
+            # The default pool keeps only 10 connections and discards the rest after each request.
+            media_adapter = make_adapter(
+                self.transport,
+                self.rate_limiter,
+                retries=retries,
+                metrics=self.metrics,
+                pool_connections=4,
+                pool_maxsize=self.image_workers + self.asset_workers * self.audio_segments + 4,
+                accept_encoding='identity',
+            )
+        # API calls get their own keep-alive pool, sized for the fetch workers, so they never
+        # queue behind image downloads for a connection. Compressed JSON is negotiated as usual.
+        self._api_adapter = make_adapter(
+            self.transport,
+            self.rate_limiter,
+            retries=retries,
+            metrics=self.metrics,
+            pool_connections=1,
+            pool_maxsize=self.fetch_workers + 4,
+        )
+        self._media_adapter = None if shared else media_adapter
+        self.session.mount('http://', media_adapter)
+        self.session.mount('https://', media_adapter)
+        # Longest prefix wins, so the newsletter's own host uses the API adapter
+        self.session.mount(f"http://{self.domain}/", self._api_adapter)
+        self.session.mount(f"https://{self.domain}/", self._api_adapter)
         if cookie:
             # Decode cookie if it's URL encoded (e.g. starts with s%3A)
             cookie = unquote(cookie)
@@ -35,143 +1128,366 @@ class SubstackScraper:
     def load_session_file(self, session_file):
         """Load session (cookies) from a Playwright JSON export."""
         try:
-            with open(session_file, 'r') as f:
-                data = json.load(f)
-            
-            # Update User-Agent
-            if 'user_agent' in data:
-                self.session.headers.update({'User-Agent': data['user_agent']})
-            
-            # Load Cookies
-            if 'cookies' in data:
-                for cookie in data['cookies']:
-                    # We only care about the name/value and domain matching
-                    # Requests wants a specific format, but setting simple dicts often works
-                    self.session.cookies.set(
-                        cookie['name'], 
-                        cookie['value'], 
-                        domain=cookie['domain'],
-                        path=cookie['path']
-                    )
+            self.apply_session_file(session_file)
             print(f"Loaded session from {session_file}")
             return True
         except Exception as e:
             print(f"Error loading session file: {e}")
             return False
 
-    def get_archive(self, limit=12, offset=0):
+    def apply_session_file(self, session_file):
+        """Like load_session_file, but quiet and raising on failure."""
+        with open(session_file, 'r') as f:
+            data = json.load(f)
+        
+        # Update User-Agent
+        if 'user_agent' in data:
+            self.session.headers.update({'User-Agent': data['user_agent']})
+        
+        # Load Cookies
+        if 'cookies' in data:
+            for cookie in data['cookies']:
+                # We only care about the name/value and domain matching
+                # Requests wants a specific format, but setting simple dicts often works
+                self.session.cookies.set(
+                    cookie['name'], 
+                    cookie['value'], 
+                    domain=cookie['domain'],
+                    path=cookie['path']
+                )
+
+    def get_archive(self, limit=12, offset=0, search='', sort='new'):
         """Fetch list of posts from the archive API."""
+        try:
+            return self.fetch_archive_page(limit=limit, offset=offset, search=search, sort=sort)
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching archive: {e}")
+            return []
+
+    def fetch_archive_page(self, limit=12, offset=0, search='', sort='new'):
+        """Like get_archive, but quiet and raising requests exceptions on failure."""
         url = f"{self.base_url}/api/v1/archive"
         params = {
-            'sort': 'new',
-            'search': '',
+            'sort': sort,
+            'search': search,
             'offset': offset,
             'limit': limit
         }
         try:
-            response = self.session.get(url, params=params)
+            with self.metrics.timer('archive_page'):
+                response = self.session.get(url, params=params)
             response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching archive: {e}")
-            return []
+        except requests.exceptions.RequestException:
+            self.metrics.incr('archive_failures')
+            raise
+        self.metrics.incr('bytes_api', len(response.content))
+        posts = response.json()
+        if self.raw_cache:
+            key = f"{offset}-{limit}" if not search else f"search-{search}-{offset}-{limit}"
+            self.raw_cache.put('archive', key, posts)
+        return posts
 
     def get_post(self, slug):
         """Fetch full post content."""
-        url = f"{self.base_url}/api/v1/posts/{slug}"
         try:
-            response = self.session.get(url)
-            response.raise_for_status()
-            return response.json()
+            return self.fetch_post(slug)
         except requests.exceptions.RequestException as e:
             print(f"Error fetching post {slug}: {e}")
             return None
 
-    def download_image(self, img_url, assets_dir):
-        """Download an image and return its local filename."""
+    def fetch_post(self, slug):
+        """Like get_post, but quiet and raising requests exceptions on failure."""
+        url = f"{self.base_url}/api/v1/posts/{slug}"
         try:
-            # Parse URL to get filename
-            parsed = urlparse(img_url)
-            filename = os.path.basename(parsed.path)
-            
-            # Remove query parameters if present
-            if '?' in filename:
-                filename = filename.split('?')[0]
-                
-            if not filename or not filename.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp')):
-                filename = f"image_{int(time.time())}_{len(os.listdir(assets_dir))}.jpg"
-
-            # Check if likely a relative URL or needs base
-            if not img_url.startswith(('http:', 'https:')):
-                img_url = urljoin(self.base_url, img_url)
-
-            local_path = os.path.join(assets_dir, filename)
-            
-            # Don't re-download if exists
-            if os.path.exists(local_path):
-                return filename
-
-            response = self.session.get(img_url, stream=True)
+            with self.metrics.timer('post_fetch'):
+                response = self.session.get(url)
             response.raise_for_status()
-            
-            with open(local_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            
-            return filename
+        except requests.exceptions.RequestException:
+            self.metrics.incr('post_fetch_failures')
+            raise
+        self.metrics.incr('bytes_api', len(response.content))
+        post = response.json()
+        if self.raw_cache:
+            self.raw_cache.put('posts', slug, post)
+        return post
+
+    def close(self):
+        """Close this scraper's connection pools, the transcode pool and the packed archive, if there are any."""
+        self._api_adapter.close()
+        if self._media_adapter:
+            self._media_adapter.close()
+        if self._transcode_pool:
+            self._transcode_pool.shutdown()
+            self._transcode_pool = None
+        if self.pack:
+            self.pack.close()
+
+    def _asset_store(self, assets_dir):
+        """Return the (cached) content-addressed store for an assets directory."""
+        with self._asset_stores_lock:
+            store = self._asset_stores.get(assets_dir)
+            if store is None:
+                # In a batch, newsletters sharing a store directory share its index and download locks
+                index = self.shared.asset_index(self.asset_store_dir) if self.shared and self.asset_store_dir else None
+                store = AssetStore(assets_dir, shared_dir=self.asset_store_dir, metrics=self.metrics, pack=self.pack, index=index)
+                self._asset_stores[assets_dir] = store
+            return store
+
+    def _absolute_url(self, url):
+        # Check if likely a relative URL or needs base
+        if not url.startswith(('http:', 'https:')):
+            return urljoin(self.base_url, url)
+        return url
+
+    def _image_request(self, src, srcset=None):
+        """Return the URL to download for an <img> and the key its local copy is stored under."""
+        url = self._absolute_url(sized_image_url(src, srcset, self.image_width))
+        if self.image_format:
+            # Transcoded copies are kept apart from plain downloads of the same URL
+            return url, f"{url}#{self.image_format},{self.image_width or ''},{self.image_max_bytes or ''}"
+        return url, url
+
+    def _transcode(self, path, ext):
+        # Pillow work is CPU-bound, so it runs in its own process pool
+        with self._image_executor_lock:
+            if self._transcode_pool is None:
+                self._transcode_pool = _process_pool(self.transcode_workers)
+        with self.metrics.timer('image_transcode'):
+            out_path = _run_in_pool(
+                self._transcode_pool, transcode_image, path, self.image_format, self.image_width, self.image_max_bytes
+            )
+        if not out_path:
+            return path, ext
+        self.metrics.incr('bytes_saved_transcoding', os.path.getsize(path) - os.path.getsize(out_path))
+        return out_path, f".{self.image_format}"
+
+    def download_image(self, img_url, assets_dir, srcset=None):
+        """Download an image and return its local filename."""
+        try:
+            return self.fetch_image(img_url, assets_dir, srcset)
         except Exception as e:
             print(f"Failed to download image {img_url}: {e}")
             return None
 
+    def fetch_image(self, img_url, assets_dir, srcset=None):
+        """Like download_image, but quiet and raising on failure."""
+        img_url, key = self._image_request(img_url, srcset)
+        try:
+            with self.metrics.timer('image_fetch'):
+                return self._asset_store(assets_dir).fetch(
+                    self.session, img_url, IMAGE_EXTENSIONS, '.jpg',
+                    key=key, transform=self._transcode if self.image_format else None,
+                )
+        except Exception:
+            self.metrics.incr('image_failures')
+            raise
+
+    def download_images(self, img_urls, assets_dir, srcsets=None):
+        """Download images concurrently and return a map of URL -> local relative path."""
+        srcsets = srcsets or {}
+        # Fetch each distinct source once, even if the post embeds it several times
+        unique_urls = list(dict.fromkeys(url for url in img_urls if url))
+        if not unique_urls:
+            return {}
+
+        # All posts share one pool, so the number of concurrent CDN requests stays bounded
+        # even when several posts are fetching their assets at the same time
+        with self._image_executor_lock:
+            if self._image_executor is None:
+                self._image_executor = ThreadPoolExecutor(max_workers=self.image_workers)
+
+        filenames = self._image_executor.map(lambda url: self.download_image(url, assets_dir, srcsets.get(url)), unique_urls)
+        return {
+            url: f"assets/{filename}"
+            for url, filename in zip(unique_urls, filenames)
+            if filename
+        }
+
     def download_audio(self, audio_url, assets_dir):
         """Download an audio file and return its local filename."""
         try:
-            # Parse URL to get filename
-            parsed = urlparse(audio_url)
-            filename = os.path.basename(parsed.path)
-            
-            # Remove query parameters if present
-            if '?' in filename:
-                filename = filename.split('?')[0]
-                
-            if not filename or not filename.lower().endswith(('.mp3', '.m4a', '.wav', '.ogg')):
-                filename = f"audio_{int(time.time())}.mp3"
-
-            local_path = os.path.join(assets_dir, filename)
-            
-            # Don't re-download if exists
-            if os.path.exists(local_path):
-                return filename
-
-            print(f"Downloading audio: {filename}")
-            response = self.session.get(audio_url, stream=True)
-            response.raise_for_status()
-            
-            with open(local_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            
-            return filename
+            if not self._asset_store(assets_dir).lookup(audio_url):
+                print(f"Downloading audio: {os.path.basename(urlparse(audio_url).path)}")
+            return self.fetch_audio(audio_url, assets_dir)
         except Exception as e:
             print(f"Failed to download audio {audio_url}: {e}")
             return None
 
+    def fetch_audio(self, audio_url, assets_dir):
+        """Like download_audio, but quiet and raising on failure."""
+        try:
+            store = self._asset_store(assets_dir)
+            filename = store.lookup(audio_url)
+            if filename:
+                self.metrics.incr('asset_cache_hits')
+                return filename
+
+            with store.url_lock(audio_url):
+                filename = store.lookup(audio_url)
+                if filename:
+                    self.metrics.incr('asset_cache_hits')
+                    return filename
+
+                part_path = store.part_path(audio_url)
+                with self.metrics.timer('audio_fetch'):
+                    content_type = self._download_resumable(audio_url, part_path)
+                self.metrics.incr('bytes_assets', os.path.getsize(part_path))
+                ext = AssetStore.extension_for(audio_url, content_type, AUDIO_EXTENSIONS, '.mp3')
+                # Only a complete, verified file is moved into the store
+                return store.add_file(audio_url, part_path, ext)
+        except Exception:
+            self.metrics.incr('audio_failures')
+            raise
+
+    def _download_resumable(self, url, part_path):
+        """Download url into part_path, resuming whatever a previous attempt left there.
+
+        Large files are split into self.audio_segments byte ranges fetched in parallel when
+        the server supports it. The result is checked against Content-Length. Returns the
+        response's Content-Type.
+        """
+        total = None
+        accepts_ranges = False
+        content_type = None
+        try:
+            head = self.session.head(url, allow_redirects=True, timeout=DOWNLOAD_TIMEOUT)
+            if head.ok:
+                content_type = head.headers.get('Content-Type')
+                accepts_ranges = head.headers.get('Accept-Ranges', '').lower() == 'bytes'
+                if head.headers.get('Content-Length', '').isdigit():
+                    total = int(head.headers['Content-Length'])
+        except requests.exceptions.RequestException:
+            # Not every server answers HEAD; a plain streamed GET still works
+            pass
+
+        segments = self.audio_segments
+        if total is not None and accepts_ranges:
+            segments = min(segments, max(1, total // MIN_SEGMENT_BYTES))
+        else:
+            segments = 1
+
+        if segments > 1 and not os.path.exists(part_path):
+            bounds = [(total * i // segments, total * (i + 1) // segments - 1) for i in range(segments)]
+            # Byte ranges depend on the file size and the segment count, so both are part of
+            # the name: segments left by a run with other settings (or an older version of
+            # the file) are never resumed, just deleted
+            segment_paths = [f"{part_path}.{total}-{segments}.{i}" for i in range(segments)]
+            for stale_path in glob.glob(f"{glob.escape(part_path)}.*"):
+                if stale_path not in segment_paths:
+                    os.remove(stale_path)
+            for segment_path, (start, end) in zip(segment_paths, bounds):
+                if os.path.exists(segment_path) and os.path.getsize(segment_path) > end - start + 1:
+                    os.remove(segment_path)
+            with ThreadPoolExecutor(max_workers=segments) as executor:
+                list(executor.map(
+                    lambda args: self._download_range(url, args[0], start=args[1][0], end=args[1][1]),
+                    zip(segment_paths, bounds),
+                ))
+            for segment_path, (start, end) in zip(segment_paths, bounds):
+                size = os.path.getsize(segment_path)
+                if size != end - start + 1:
+                    if size > end - start + 1:
+                        # Can't be resumed; start this segment over next time
+                        os.remove(segment_path)
+                    raise IOError(f"segment {segment_path} is incomplete")
+            with open(part_path, 'wb') as out:
+                for segment_path in segment_paths:
+                    with open(segment_path, 'rb') as f:
+                        shutil.copyfileobj(f, out, 1024 * 1024)
+            for segment_path in segment_paths:
+                os.remove(segment_path)
+        else:
+            response_type = self._download_range(url, part_path)
+            content_type = content_type or response_type
+
+        size = os.path.getsize(part_path)
+        if total is not None and size != total:
+            # Most likely the file changed on the server since the .part was started
+            os.remove(part_path)
+            raise IOError(f"expected {total} bytes, got {size}")
+        return content_type
+
+    def _download_range(self, url, path, start=0, end=None):
+        """Fetch bytes start..end (inclusive; end=None for the rest) of url into path.
+
+        Bytes already in path are kept and only the remainder is requested, so interrupted
+        transfers resume instead of starting over. Returns the response's Content-Type.
+        """
+        content_type = None
+        for attempt in range(self.retries + 1):
+            have = os.path.getsize(path) if os.path.exists(path) else 0
+            if end is not None and start + have > end:
+                return content_type
+
+            headers = {}
+            if start + have > 0 or end is not None:
+                headers['Range'] = f"bytes={start + have}-{'' if end is None else end}"
+            try:
+                with self.session.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+                    if response.status_code == 416 and end is None:
+                        # Nothing left past what we already have
+                        return content_type
+                    response.raise_for_status()
+                    content_type = response.headers.get('Content-Type')
+
+                    mode = 'ab'
+                    if headers and response.status_code != 206:
+                        if start > 0:
+                            raise IOError("server ignored the Range header")
+                        # The server sent the whole file; start over rather than append
+                        mode = 'wb'
+                    with open(path, mode) as f:
+                        for chunk in response.iter_content(chunk_size=65536):
+                            f.write(chunk)
+
+                    # A dropped connection can end the body early without raising
+                    expected = response.headers.get('Content-Length')
+                    if expected and expected.isdigit():
+                        written = os.path.getsize(path) - (have if mode == 'ab' else 0)
+                        if written < int(expected):
+                            raise requests.exceptions.ConnectionError("connection closed before the body was complete")
+                return content_type
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.exceptions.Timeout):
+                if attempt >= self.retries:
+                    raise
+                time.sleep(min(30, 2 ** attempt))
+        return content_type
+
     def get_transcript(self, slug):
         """Fetch transcript content."""
-        url = f"{self.base_url}/api/v1/posts/{slug}/transcript"
         try:
-            response = self.session.get(url)
-            if response.status_code == 200:
-                return response.json()
+            return self.fetch_transcript(slug)
         except requests.exceptions.RequestException:
-            pass
-        return None
+            return None
+
+    def fetch_transcript(self, slug):
+        """Like get_transcript, but raising requests exceptions on network failure. None means no transcript."""
+        url = f"{self.base_url}/api/v1/posts/{slug}/transcript"
+        with self.metrics.timer('transcript_fetch'):
+            response = self.session.get(url)
+        if response.status_code != 200:
+            return None
+        self.metrics.incr('bytes_api', len(response.content))
+        transcript = response.json()
+        if self.raw_cache:
+            self.raw_cache.put('transcripts', slug, transcript)
+        return transcript
 
     def save_post(self, post, output_dir, html_only=False, md_only=False):
         """Save post content to file (HTML and/or Markdown) with local images."""
+        job = self.parse_post(post, output_dir)
+        if job:
+            self.fetch_post_assets(job)
+            self.write_post(job, html_only=html_only, md_only=md_only)
+
+    def parse_post(self, post, output_dir):
+        """Work out where a post will be saved and which images it needs. Returns None if there is nothing to save."""
         if not post:
-            return
+            return None
+        with self.metrics.timer('image_scan'):
+            return self._parse_post(post, output_dir)
 
+    def _parse_post(self, post, output_dir):
         date = post.get('post_date', '').split('T')[0]
         slug = post.get('slug', 'unknown')
         title = post.get('title', 'Untitled')
@@ -182,243 +1498,1840 @@ class SubstackScraper:
         
         html_content = post.get('body_html', '')
         if not html_content:
-            return
+            return None
 
         # Prepare assets directory
         assets_dir = os.path.join(output_dir, "assets")
-        if not os.path.exists(assets_dir):
-            os.makedirs(assets_dir)
+        os.makedirs(assets_dir, exist_ok=True)
 
-        # Process HTML with BeautifulSoup to find and download images
-        from bs4 import BeautifulSoup
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        # Dictionary to map original URLs to local filenames for Markdown conversion
-        image_map = {}
+        # A light scan for <img> sources and links; the full parse happens once, at render time
+        scanner = scan_html(html_content)
+        return {
+            'post': post,
+            'output_dir': output_dir,
+            'assets_dir': assets_dir,
+            'date': date,
+            'slug': slug,
+            'title': title,
+            'filename_base': filename_base,
+            'html': html_content,
+            'image_sources': scanner.sources,
+            'image_srcsets': scanner.srcsets,
+            'links': scanner.links,
+            # href -> filename_base of the saved post it points at, filled in just before rendering
+            'link_map': {},
+            'image_map': {},
+            'audio_filename': None,
+            'transcript_html': None,
+            'assets': [],
+        }
 
-        for img in soup.find_all('img'):
-            src = img.get('src')
-            if src:
-                local_filename = self.download_image(src, assets_dir)
-                if local_filename:
-                    # Update HTML src to point to local file (relative path)
-                    img['src'] = f"assets/{local_filename}"
-                    # Remove srcset to force browser to use src
-                    if img.has_attr('srcset'):
-                        del img['srcset']
-                    
-                    image_map[src] = f"assets/{local_filename}"
+    def fetch_post_assets(self, job):
+        """Download a parsed post's images, audio and transcript, and record where the local copies are."""
+        with self.metrics.timer('asset_fetch'):
+            return self._fetch_post_assets(job)
+
+    def _fetch_post_assets(self, job):
+        post = job['post']
+
+        # Dictionary to map original URLs to local filenames for Markdown conversion
+        image_map = self.download_images(job['image_sources'], job['assets_dir'], job['image_srcsets'])
 
         # Download Audio
-        audio_url = post.get('audio_url')
         audio_filename = None
+        audio_url = post.get('audio_url')
         if audio_url:
-            audio_filename = self.download_audio(audio_url, assets_dir)
+            audio_filename = self.download_audio(audio_url, job['assets_dir'])
 
         # Download Transcript
         transcript_html = None
         if post.get('type') == 'podcast':
-            transcript_data = self.get_transcript(slug)
+            transcript_data = self.get_transcript(job['slug'])
             if transcript_data:
                 transcript_html = transcript_data.get('body_html')
 
-        # 1. Save HTML (if not disabled)
-        if not md_only:
-            # Modern, Reader-Mode style CSS
-            css = """
-            <style>
-                body {
-                    font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif;
-                    line-height: 1.6;
-                    color: #333;
-                    max-width: 800px;
-                    margin: 0 auto;
-                    padding: 20px;
-                }
-                img {
-                    max-width: 100%;
-                    height: auto;
-                    display: block;
-                    margin: 20px auto;
-                    border-radius: 8px;
-                }
-                h1 {
-                    font-size: 2.2em;
-                    margin-bottom: 0.5em;
-                    color: #1a1a1a;
-                }
-                a {
-                    color: #0066cc;
-                    text-decoration: none;
-                }
-                a:hover {
-                    text-decoration: underline;
-                }
-                pre {
-                    background: #f4f4f4;
-                    padding: 15px;
-                    border-radius: 5px;
-                    overflow-x: auto;
-                }
-                blockquote {
-                    border-left: 4px solid #ddd;
-                    margin: 0;
-                    padding-left: 15px;
-                    color: #666;
-                }
-                audio {
-                    width: 100%;
-                    margin: 20px 0;
-                }
-            </style>
-            """
-            
-            html_body = soup.prettify()
-            if audio_filename:
-                html_body = f'<audio controls src="assets/{audio_filename}"></audio>\n' + html_body
-
-            # We save the modified soup with local image links
-            full_html = f"<html><head><title>{title}</title>{css}</head><body><h1>{title}</h1>{html_body}</body></html>"
-            with open(os.path.join(output_dir, f"{filename_base}.html"), 'w', encoding='utf-8') as f:
-                f.write(full_html)
-
-            if transcript_html:
-                transcript_soup = BeautifulSoup(transcript_html, 'html.parser')
-                full_transcript_html = f"<html><head><title>{title} - Transcript</title>{css}</head><body><h1>{title} - Transcript</h1>{transcript_soup.prettify()}</body></html>"
-                with open(os.path.join(output_dir, f"{filename_base}_transcript.html"), 'w', encoding='utf-8') as f:
-                    f.write(full_transcript_html)
-
-        # 2. Save Markdown (if not disabled)
-        if not html_only:
-            from markdownify import markdownify
-            
-            # Convert the MODIFIED html (with local links) to Markdown
-            # This ensures the markdown points to assets/image.jpg
-            md_content = markdownify(str(soup), heading_style="ATX")
-            
-            # Add metadata header
-            full_md = f"# {title}\n\nDate: {date}\nURL: {self.base_url}/p/{slug}\n\n"
-            if audio_filename:
-                full_md += f"**Audio:** [Listen locally](assets/{audio_filename})\n\n"
-            full_md += md_content
-            
-            with open(os.path.join(output_dir, f"{filename_base}.md"), 'w', encoding='utf-8') as f:
-                f.write(full_md)
+        return self._attach_assets(job, image_map, audio_filename, transcript_html)
 
-            if transcript_html:
-                transcript_md = markdownify(transcript_html, heading_style="ATX")
-                with open(os.path.join(output_dir, f"{filename_base}_transcript.md"), 'w', encoding='utf-8') as f:
-                    f.write(f"# {title} - Transcript\n\n{transcript_md}")
+    def attach_cached_assets(self, job, saved_images=None):
+        """Offline counterpart of fetch_post_assets: only use files already in the asset store and raw cache.
+
+        saved_images is the post's {src: 'assets/<file>'} from the manifest; those files are
+        used as they are, whatever image options they were downloaded with.
+        """
+        post = job['post']
+        store = self._asset_store(job['assets_dir'])
+        saved_images = saved_images or {}
+
+        image_map = {}
+        for src in job['image_sources']:
+            if src in image_map:
+                continue
+            saved = saved_images.get(src)
+            if saved and store.has(saved[len('assets/'):]):
+                image_map[src] = saved
+            else:
+                # Fall back to the plain URL for images saved before a width or format was set
+                _url, key = self._image_request(src, job['image_srcsets'].get(src))
+                filename = store.lookup(key) or store.lookup(self._absolute_url(src))
+                if filename:
+                    image_map[src] = f"assets/{filename}"
+
+        audio_url = post.get('audio_url')
+        audio_filename = store.lookup(audio_url) if audio_url else None
+
+        transcript_html = None
+        if post.get('type') == 'podcast' and self.raw_cache:
+            transcript_data = self.raw_cache.get('transcripts', job['slug'])
+            if transcript_data:
+                transcript_html = transcript_data.get('body_html')
+
+        return self._attach_assets(job, image_map, audio_filename, transcript_html)
+
+    def _attach_assets(self, job, image_map, audio_filename, transcript_html):
+        job['image_map'] = image_map
+        job['audio_filename'] = audio_filename
+        job['transcript_html'] = transcript_html
+        job['assets'] = sorted(set(image_map.values()))
+        if audio_filename:
+            job['assets'].append(f"assets/{audio_filename}")
+        return job
+
+    def write_run_report(self, json_path=None, prom_path=None, newsletter=None):
+        """Save this run's metrics (plus the pipeline's per-stage stats) as JSON and/or a Prometheus textfile."""
+        if json_path:
+            stages = self.last_pipeline.stats if self.last_pipeline else {}
+            self.metrics.write_json(json_path, newsletter=newsletter, stages=stages)
+            print(f"Run report saved to {json_path}")
+        if prom_path:
+            self.metrics.write_prometheus(prom_path, labels={'newsletter': newsletter} if newsletter else None)
+            print(f"Prometheus metrics saved to {prom_path}")
+
+    def write_post(self, job, html_only=False, md_only=False):
+        """Render a post whose assets have been fetched and write it to disk."""
+        text = {} if self.search_index is not None else None
+        contents = {} if self.pack is not None else None
+        files = render_post(job, self.base_url, html_only=html_only, md_only=md_only, text=text, contents=contents)
+        self._store_outputs(contents)
+        self._index_post(job['post'], files, text)
+        return files
+
+    def render_archive(self, output_dir, html_only=False, md_only=False):
+        """Rebuild every post's HTML/Markdown from the raw cache, without any network requests."""
+        _refuse_in_spawned_worker()
+        if not self.raw_cache:
+            raise ValueError("render_archive needs a raw cache (raw_cache_dir)")
+
+        slugs = self.raw_cache.keys('posts')
+        print(f"Rendering {len(slugs)} cached posts...")
+        if not slugs:
+            return 0
+
+        manifest = Manifest(output_dir, pack=self.pack)
+        cross_links = CrossLinks(manifest, self.domain, output_dir, pack=self.pack)
+        rendered = 0
+        try:
+            # Parsing and markdownify are CPU-bound, so spread posts across processes.
+            # Each worker gets the saved posts' filenames once, to rewrite links between posts.
+            initargs = (
+                self.base_url, self.asset_store_dir, self.raw_cache.root, self.pack.path if self.pack else None,
+                cross_links.filename_bases,
+                {'image_width': self.image_width, 'image_format': self.image_format, 'image_max_bytes': self.image_max_bytes},
+            )
+            with self._render_profile() as profile_dir, _process_pool(
+                self.render_workers, initializer=_init_render_worker, initargs=initargs,
+            ) as executor:
+                extract_text = self.search_index is not None
+                tasks = [
+                    (slug, output_dir, html_only, md_only, profile_dir, extract_text, manifest.image_map(slug))
+                    for slug in slugs
+                ]
+                results = _map_in_pool(
+                    executor, _render_cached_post, tasks, chunksize=8, initializer=_init_render_worker, initargs=initargs
+                )
+                for result in tqdm(results, total=len(tasks), desc="Rendering", unit="posts"):
+                    if result:
+                        post, files, assets, image_map, timings, text, contents, filename_base, unresolved = result
+                        self._record_render_timings(timings)
+                        self._store_outputs(contents)
+                        manifest.record(post, files, assets, image_map)
+                        cross_links.saved(post.get('slug'), filename_base, files, unresolved)
+                        self._index_post(post, files, text)
+                        rendered += 1
+                    else:
+                        self.metrics.incr('render_failures')
+            self.update_index(manifest, output_dir)
+        finally:
+            if self.pack:
+                self.pack.flush()
+            manifest.close()
+        return rendered
+
+    def iter_archive(self, page_size=50, total=None, index_path=None, search='', since=None, until=None, strict=False):
+        """Yield archive entries newest first, fetching pages only as they are consumed.
+
+        If total is known (or estimated), the first total entries are fetched in parallel by
+        offset; anything after that is paged in one request at a time until the archive runs out.
+        Full entries are written to index_path (JSONL) when given, and only a slim summary
+        (ARCHIVE_FIELDS) is yielded, so callers never hold whole archive dicts in memory.
+
+        search is passed to the archive API. since/until are inclusive 'YYYY-MM-DD' dates:
+        newer posts are skipped, and paging stops at the first post older than since.
+        With strict, a failed page raises instead of being treated as the end of the archive.
+        """
+        # A page that fails (after retries) ends the listing early; remember it, so a
+        # truncated listing never replaces the archive index
+        failed = []
+
+        def get_page(**kwargs):
+            try:
+                return self.fetch_archive_page(**kwargs)
+            except requests.exceptions.RequestException as e:
+                if strict:
+                    raise
+                print(f"Error fetching archive: {e}")
+                failed.append(e)
+                return []
+
+        if since:
+            # Paging stops early, so only fetch one page at a time
+            total = None
+        index_file = None
+        tmp_path = None
+        if index_path:
+            os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+            tmp_path = f"{index_path}.tmp"
+            index_file = open(tmp_path, 'w', encoding='utf-8')
+
+        past_since = False
+
+        def emit(page):
+            nonlocal past_since
+            for post in page:
+                if index_file:
+                    index_file.write(json.dumps(post) + "\n")
+                post_day = (post.get('post_date') or '')[:10]
+                if since and post_day and post_day < since:
+                    # The archive is sorted newest first, so nothing after this matches either
+                    past_since = True
+                    return
+                if until and post_day and post_day > until:
+                    continue
+                yield {key: post[key] for key in ARCHIVE_FIELDS if key in post}
+
+        executor = None
+        completed = False
+        try:
+            offset = 0
+            if total:
+                executor = ThreadPoolExecutor(max_workers=self.fetch_workers)
+                pages = executor.map(
+                    lambda page_offset: get_page(limit=page_size, offset=page_offset, search=search),
+                    range(0, total, page_size),
+                )
+                for page in pages:
+                    yield from emit(page)
+                    offset += len(page)
+                    if past_since or len(page) < page_size:
+                        completed = True
+                        return
+                executor.shutdown(wait=False)
 
-    def get_all_archive_posts(self):
-        """Fetch all posts from archive to get total count and metadata."""
-        all_posts = []
-        offset = 0
-        limit = 50
-        
-        print("Fetching all post metadata...")
-        with tqdm(desc="Fetching metadata", unit="posts") as pbar:
             while True:
-                posts = self.get_archive(limit=limit, offset=offset)
-                if not posts:
+                page = get_page(limit=page_size, offset=offset, search=search)
+                yield from emit(page)
+                if past_since:
                     break
-                
-                all_posts.extend(posts)
-                count = len(posts)
-                offset += count
-                pbar.update(count)
-                
-                if count < limit:
+
+                # Since we might skip posts, we can't just rely on the number downloaded for offset
+                # We must consistently move the offset by the number of posts fetched from API
+                offset += len(page)
+
+                if len(page) < page_size:  # No more posts (checked against what we asked for)
                     break
+            completed = True
+        finally:
+            if executor:
+                # The consumer may stop early (e.g. --limit); don't fetch pages nobody will read
+                executor.shutdown(wait=False, cancel_futures=True)
+            if index_file:
+                index_file.close()
+                # Only a complete, error-free pass replaces the previous index
+                if completed and not failed:
+                    os.replace(tmp_path, index_path)
+                else:
+                    os.remove(tmp_path)
+
+    @staticmethod
+    def archive_index_path(output_dir):
+        return os.path.join(output_dir, ARCHIVE_INDEX_FILENAME)
+
+    @staticmethod
+    def _estimate_archive_size(index_path):
+        """Number of entries seen on the previous full pass, used to fetch pages in parallel."""
+        if not os.path.exists(index_path):
+            return None
+        with open(index_path, 'rb') as f:
+            return sum(1 for _ in f) or None
+
+    def get_all_archive_posts(self, output_dir=None):
+        """Fetch all posts from archive to get total count and metadata."""
+        index_path = self.archive_index_path(output_dir) if output_dir else None
+        total = self._estimate_archive_size(index_path) if index_path else None
+
+        print("Fetching all post metadata...")
+        all_posts = []
+        with tqdm(desc="Fetching metadata", unit="posts") as pbar:
+            for post in self.iter_archive(total=total, index_path=index_path):
+                all_posts.append(post)
+                pbar.update(1)
         return all_posts
 
-    def download_posts(self, posts, output_dir, skip_podcasts=False, html_only=False, md_only=False):
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-            
-        print(f"Downloading {len(posts)} posts...")
-        for post_summary in tqdm(posts, desc="Downloading content"):
+    def _wanted_posts(self, posts, skip_podcasts=False, limit=None, manifest=None):
+        """Yield archive entries that should be downloaded, applying podcast skipping, sync and the post limit."""
+        count = 0
+        for post_summary in posts:
+            if limit and count >= limit:
+                break
+
             slug = post_summary.get('slug')
             if not slug:
                 continue
 
+            # Check if it's a podcast
             is_podcast = post_summary.get('type') == 'podcast' or post_summary.get('podcast_url') is not None
             if skip_podcasts and is_podcast:
                 continue
-                
-            time.sleep(1)
-            
-            full_post = self.get_post(slug)
-            if full_post:
-                self.save_post(full_post, output_dir, html_only=html_only, md_only=md_only)
 
-    def scrape(self, output_dir="archive", limit=None, skip_podcasts=False, html_only=False, md_only=False):
-        """Main scraping loop."""
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
+            # In sync mode, posts already saved and not updated since are skipped without a request
+            if manifest and manifest.is_current(post_summary):
+                self.metrics.incr('manifest_skips')
+                continue
+
+            count += 1
+            yield post_summary
+
+    def _fetch_for_pipeline(self, post_summary, manifest, sync):
+        post = self.get_post(post_summary['slug'])
+        # An updated timestamp doesn't always mean the body changed; skip the re-render if it didn't
+        if post and sync and manifest.is_unchanged(post):
+            self.metrics.incr('unchanged_skips')
+            return None
+        return post
+
+    def update_index(self, manifest, output_dir):
+        """Refresh the newsletter's index pages and feed for the posts saved since the last update."""
+        with self.metrics.timer('index_update'):
+            return ArchiveIndex(output_dir, self.base_url, manifest, pack=self.pack, library_root=self.library_root).update()
+
+    def _write_for_pipeline(self, job, manifest, cross_links, render_pool, profile_dir, html_only, md_only):
+        job['link_map'], unresolved = cross_links.resolve(job['links'])
+        # Rendering is CPU-bound; hand it to a worker process so it runs on another core
+        files, timings, text, contents = _run_in_pool(
+            render_pool, _render_job, job, self.base_url, html_only, md_only, profile_dir, self.search_index is not None, self.pack is not None
+        )
+        self._record_render_timings(timings)
+        self._store_outputs(contents)
+        manifest.record(job['post'], files, job['assets'], job['image_map'])
+        cross_links.saved(job['slug'], job['filename_base'], files, unresolved)
+        self._index_post(job['post'], files, text)
+        return files
 
+    def _store_outputs(self, contents):
+        # Rendered files collected for the packed archive (None when writing loose files)
+        if contents:
+            with self.metrics.timer('pack_write'):
+                for name, data in contents.items():
+                    self.pack.put(name, data)
+
+    def _index_post(self, post, files, text):
+        if self.search_index is None or text is None or not files:
+            return
+        # Point search results at the Markdown file when there is one
+        markdown = [name for name in files if name.endswith('.md') and not name.endswith('_transcript.md')]
+        path = os.path.join(self.domain, (markdown or files)[0])
+        with self.metrics.timer('search_index'):
+            self.search_index.add(self.domain, post, text, path)
+
+    def _record_render_timings(self, timings):
+        for phase, seconds in timings.items():
+            self.metrics.observe(phase, seconds)
+        self.metrics.incr('posts_rendered')
+
+    @contextmanager
+    def _render_profile(self):
+        """Yield a scratch directory for per-post profiles (or None), merging them into profile_path afterwards."""
+        if not self.profile_path:
+            yield None
+            return
+        profile_dir = tempfile.mkdtemp(prefix="substack-profile-")
+        try:
+            yield profile_dir
+        finally:
+            files = [os.path.join(profile_dir, name) for name in os.listdir(profile_dir)]
+            if files:
+                pstats.Stats(*files).dump_stats(self.profile_path)
+                print(f"Render profile saved to {self.profile_path}")
+            shutil.rmtree(profile_dir, ignore_errors=True)
+
+    @contextmanager
+    def _render_pool(self):
+        # A batch run shares one process pool; a single newsletter gets its own for the run
+        if self.shared:
+            yield self.shared.render_pool
+            return
+        with _process_pool(self.render_workers) as render_pool:
+            yield render_pool
+
+    def _run_pipeline(self, posts, output_dir, manifest, sync=False, html_only=False, md_only=False, total=None):
+        """Download, parse, fetch assets for and write posts through a staged pipeline."""
+        cross_links = CrossLinks(manifest, self.domain, output_dir, pack=self.pack)
+        with self._render_profile() as profile_dir, self._render_pool() as render_pool:
+            pipeline = Pipeline([
+                ('fetch', lambda post_summary: self._fetch_for_pipeline(post_summary, manifest, sync), self.fetch_workers),
+                ('parse', lambda post: self.parse_post(post, output_dir), 1),
+                ('assets', self.fetch_post_assets, self.asset_workers),
+                ('write', lambda job: self._write_for_pipeline(job, manifest, cross_links, render_pool, profile_dir, html_only, md_only), self.render_workers),
+            ], queue_size=self.queue_size)
+
+            self.last_pipeline = pipeline
+            with tqdm(total=total, desc=self.progress_label or "Downloading content", unit="posts", position=self.progress_position) as pbar:
+                return pipeline.run(posts, on_item_done=lambda _result: pbar.update(1))
+
+    def download_posts(self, posts, output_dir, skip_podcasts=False, html_only=False, md_only=False, sync=False):
+        _refuse_in_spawned_worker()
+        manifest = Manifest(output_dir, pack=self.pack)
+        try:
+            wanted = list(self._wanted_posts(posts, skip_podcasts=skip_podcasts, manifest=manifest if sync else None))
+            if sync:
+                print(f"Skipping {len(posts) - len(wanted)} posts that are up to date or filtered out.")
+            print(f"Downloading {len(wanted)} posts...")
+            fetched = self._run_pipeline(wanted, output_dir, manifest, sync=sync, html_only=html_only, md_only=md_only, total=len(wanted))
+            self.update_index(manifest, output_dir)
+            return fetched
+        finally:
+            if self.pack:
+                self.pack.flush()
+            manifest.close()
+
+    def scrape(self, output_dir="archive", limit=None, skip_podcasts=False, html_only=False, md_only=False, sync=False,
+               since=None, until=None, search='', slugs=None, strict=False):
+        """Main scraping loop.
+
+        since/until ('YYYY-MM-DD', or since='last' for the newest post already saved), search
+        and slugs narrow what is downloaded without listing the whole archive. With strict,
+        an archive page that can't be fetched raises instead of ending the listing early.
+        """
+        _refuse_in_spawned_worker()
         print(f"Starting scrape for {self.base_url}...")
-        
-        offset = 0
-        batch_size = 12
-        total_fetched = 0
-        
-        while True:
-            if limit and total_fetched >= limit:
-                break
-                
-            batch_limit = batch_size
-            if limit and (limit - total_fetched) < batch_size:
-                batch_limit = limit - total_fetched
 
-            print(f"Fetching posts {offset} to {offset + batch_limit}...")
-            posts = self.get_archive(limit=batch_limit, offset=offset)
-            
-            if not posts:
-                break
-                
-            for post_summary in tqdm(posts):
-                if limit and total_fetched >= limit:
+        manifest = Manifest(output_dir, pack=self.pack)
+        try:
+            if since == 'last':
+                since = manifest.latest_post_date()
+                print(f"Syncing posts since {since or 'the beginning'}...")
+
+            if slugs:
+                # Known posts can be fetched directly, no archive listing needed
+                archive = [{'slug': slug} for slug in slugs]
+            else:
+                # Archive pages are fetched lazily, so the first posts are downloading
+                # while later pages of the archive are still being requested.
+                # A filtered listing is partial, so it must not replace the archive index.
+                filtered = bool(search or since or until)
+                index_path = None if filtered else self.archive_index_path(output_dir)
+                archive = self.iter_archive(
+                    total=limit or (None if filtered else self._estimate_archive_size(index_path)),
+                    index_path=index_path,
+                    search=search,
+                    since=since,
+                    until=until,
+                    strict=strict,
+                )
+            posts = self._wanted_posts(
+                archive,
+                skip_podcasts=skip_podcasts,
+                limit=limit,
+                manifest=manifest if sync else None,
+            )
+            total_fetched = self._run_pipeline(posts, output_dir, manifest, sync=sync, html_only=html_only, md_only=md_only, total=limit)
+            self.update_index(manifest, output_dir)
+        finally:
+            if self.pack:
+                self.pack.flush()
+            manifest.close()
+
+        print(f"Scraping complete. Downloaded {total_fetched} posts.")
+        return total_fetched
+
+
+class Pipeline:
+    """Run items through a chain of stages, each with its own worker threads.
+
+    Stages are connected by bounded queues, so a slow stage applies back-pressure to the
+    ones before it instead of letting work pile up in memory. A stage function returns the
+    item for the next stage, or None to drop it (e.g. a post that failed to download).
+    """
+
+    _DONE = object()
+
+    def __init__(self, stages, queue_size=8):
+        # Each stage is a (name, func, workers) tuple
+        self.stages = stages
+        self.queue_size = queue_size
+        # Per stage: items processed, items dropped/failed and total seconds spent in the stage function
+        self.stats = {name: {'items': 0, 'dropped': 0, 'seconds': 0.0} for name, _func, _workers in stages}
+
+    def run(self, items, on_item_done=None):
+        """Feed items through every stage and return the number that made it out of the last one."""
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        remaining = [workers for _name, _func, workers in self.stages]
+        lock = threading.Lock()
+        completed = [0]
+        threads = []
+
+        def worker(index):
+            name, func, _workers = self.stages[index]
+            inbox = queues[index]
+            while True:
+                item = inbox.get()
+                if item is self._DONE:
                     break
-                    
-                slug = post_summary.get('slug')
-                if not slug:
+                started = time.perf_counter()
+                try:
+                    result = func(item)
+                except Exception as e:
+                    print(f"Error in {name} stage: {e}")
+                    result = None
+                elapsed = time.perf_counter() - started
+                with lock:
+                    stats = self.stats[name]
+                    stats['items'] += 1
+                    stats['seconds'] += elapsed
+                    if result is None:
+                        stats['dropped'] += 1
+                if result is None:
                     continue
+                if index + 1 < len(self.stages):
+                    queues[index + 1].put(result)
+                else:
+                    with lock:
+                        completed[0] += 1
+                    if on_item_done:
+                        on_item_done(result)
+
+            # The last worker out of a stage tells the next stage there is no more work
+            with lock:
+                remaining[index] -= 1
+                last = remaining[index] == 0
+            if last and index + 1 < len(self.stages):
+                for _ in range(self.stages[index + 1][2]):
+                    queues[index + 1].put(self._DONE)
+
+        for index, (name, _func, workers) in enumerate(self.stages):
+            for n in range(workers):
+                thread = threading.Thread(target=worker, args=(index,), name=f"{name}-{n}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        try:
+            for item in items:
+                queues[0].put(item)
+        finally:
+            for _ in range(self.stages[0][2]):
+                queues[0].put(self._DONE)
+            # Even if the item source raised, let the items already queued finish, so the
+            # caller can close its manifest/pack safely before the error propagates
+            for thread in threads:
+                thread.join()
+
+        return completed[0]
+
+
+class Manifest:
+    """SQLite record of every post saved to an output directory.
+
+    Entries are written only after a post's files are on disk, so a run that crashes
+    midway simply re-downloads the posts it hadn't finished when it is resumed.
+    """
+
+    FILENAME = "manifest.sqlite3"
+
+    def __init__(self, output_dir, pack=None):
+        self.output_dir = output_dir
+        # Saved files are looked up in this PackedArchive instead of on disk, if given
+        self.pack = pack
+        os.makedirs(output_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # Pipeline stages call into the manifest from their own threads; the lock serializes access
+        self._conn = sqlite3.connect(os.path.join(output_dir, self.FILENAME), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS posts (
+                slug TEXT PRIMARY KEY,
+                post_id INTEGER,
+                title TEXT,
+                post_date TEXT,
+                updated_at TEXT,
+                body_hash TEXT,
+                files TEXT,
+                assets TEXT,
+                saved_at TEXT
+            )
+        """)
+        # Links to posts that weren't saved yet when the linking post was written
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pending_links (
+                source_slug TEXT,
+                target_slug TEXT,
+                href TEXT,
+                PRIMARY KEY (source_slug, href)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pending_links_target ON pending_links (target_slug)")
+        # Which local file each <img> src of a post was saved as; an offline render reuses it,
+        # since the asset store key also depends on --image-width/--image-format
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS post_images (
+                slug TEXT,
+                src TEXT,
+                path TEXT,
+                PRIMARY KEY (slug, src)
+            )
+        """)
+        # Index pages are rebuilt per year, for the posts saved since the last update
+        self._conn.execute("CREATE INDEX IF NOT EXISTS posts_saved_at ON posts (saved_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS posts_post_date ON posts (post_date)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+    @staticmethod
+    def body_hash(post):
+        return hashlib.sha256(post.get('body_html', '').encode('utf-8')).hexdigest()
+
+    def get(self, slug):
+        """Return the manifest entry for a slug as a dict, or None."""
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM posts WHERE slug = ?", (slug,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            entry = dict(zip([column[0] for column in cursor.description], row))
+        entry['files'] = json.loads(entry['files'] or '[]')
+        entry['assets'] = json.loads(entry['assets'] or '[]')
+        return entry
+
+    def _files_exist(self, entry):
+        if self.pack:
+            return bool(entry['files']) and all(self.pack.exists(name) for name in entry['files'])
+        return bool(entry['files']) and all(
+            os.path.exists(os.path.join(self.output_dir, name)) for name in entry['files']
+        )
+
+    def is_current(self, post_summary):
+        """True if an archive entry was already saved and hasn't been updated since."""
+        entry = self.get(post_summary.get('slug'))
+        if not entry or not self._files_exist(entry):
+            return False
+        # The archive listing doesn't always carry updated_at; fall back to the publish date
+        if post_summary.get('updated_at'):
+            return post_summary['updated_at'] == entry['updated_at']
+        return post_summary.get('post_date') == entry['post_date']
+
+    def is_unchanged(self, post):
+        """True if a fetched post's body matches what was saved last time."""
+        entry = self.get(post.get('slug'))
+        if not entry or not self._files_exist(entry):
+            return False
+        if entry['body_hash'] != self.body_hash(post):
+            return False
+        # Remember the new timestamp so the next sync can skip this post without fetching it
+        with self._lock:
+            self._conn.execute(
+                "UPDATE posts SET updated_at = ?, post_date = ? WHERE slug = ?",
+                (post.get('updated_at'), post.get('post_date'), post.get('slug')),
+            )
+            self._conn.commit()
+        return True
+
+    def record(self, post, files, assets, image_map=None):
+        """Store (or replace) the entry for a post whose files have just been written.
+
+        image_map ({src: 'assets/<file>'}), if given, replaces the post's saved image files.
+        """
+        with self._lock:
+            if image_map is not None:
+                self._conn.execute("DELETE FROM post_images WHERE slug = ?", (post.get('slug'),))
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO post_images VALUES (?, ?, ?)",
+                    [(post.get('slug'), src, path) for src, path in image_map.items()],
+                )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    post.get('slug'),
+                    post.get('id'),
+                    post.get('title'),
+                    post.get('post_date'),
+                    post.get('updated_at'),
+                    self.body_hash(post),
+                    json.dumps(files),
+                    json.dumps(assets),
+                    datetime.now(timezone.utc).isoformat(),
+                ),
+            )
+            self._conn.commit()
+
+    def image_map(self, slug):
+        """{src: 'assets/<file>'} of the images saved for a post."""
+        with self._lock:
+            rows = self._conn.execute("SELECT src, path FROM post_images WHERE slug = ?", (slug,)).fetchall()
+        return dict(rows)
+
+    def saved_filename_bases(self):
+        """slug -> filename_base (e.g. '2024-01-01_some-post') of every saved post."""
+        with self._lock:
+            rows = self._conn.execute("SELECT slug, files FROM posts").fetchall()
+        bases = {}
+        for slug, files in rows:
+            for name in json.loads(files or '[]'):
+                base, _ext = os.path.splitext(name)
+                if not base.endswith('_transcript'):
+                    bases[slug] = base
+                    break
+        return bases
+
+    def set_pending_links(self, source_slug, links):
+        """Replace the list of (target_slug, href) links from source_slug whose target isn't saved yet."""
+        with self._lock:
+            self._conn.execute("DELETE FROM pending_links WHERE source_slug = ?", (source_slug,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pending_links VALUES (?, ?, ?)",
+                [(source_slug, target, href) for target, href in links],
+            )
+            self._conn.commit()
+
+    def pop_pending_links(self, target_slug):
+        """Remove and return (files of the linking post, href) for every pending link to target_slug."""
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT posts.files, pending_links.href FROM pending_links
+                JOIN posts ON posts.slug = pending_links.source_slug
+                WHERE pending_links.target_slug = ?
+                """,
+                (target_slug,),
+            ).fetchall()
+            self._conn.execute("DELETE FROM pending_links WHERE target_slug = ?", (target_slug,))
+            self._conn.commit()
+        return [(json.loads(files or '[]'), href) for files, href in rows]
+
+    def get_state(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
 
-                # Check if it's a podcast
-                is_podcast = post_summary.get('type') == 'podcast' or post_summary.get('podcast_url') is not None
-                if skip_podcasts and is_podcast:
-                    print(f"Skipping podcast: {slug}")
+    def set_state(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO state VALUES (?, ?)", (key, value))
+            self._conn.commit()
+
+    def latest_saved_at(self):
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(saved_at) FROM posts").fetchone()
+        return row[0] if row else None
+
+    def changed_years(self, since=None):
+        """Years ('YYYY') with posts saved after since (a saved_at value), or every year if since is None."""
+        query = "SELECT DISTINCT substr(post_date, 1, 4) FROM posts"
+        params = ()
+        if since:
+            query += " WHERE saved_at > ?"
+            params = (since,)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return sorted((row[0] or 'undated' for row in rows), reverse=True)
+
+    def year_counts(self):
+        """(year, number of saved posts), newest year first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT substr(post_date, 1, 4), COUNT(*) FROM posts GROUP BY 1 ORDER BY 1 DESC"
+            ).fetchall()
+        return [(year or 'undated', count) for year, count in rows]
+
+    def listing(self, year=None, limit=None):
+        """Saved posts (slug, title, post_date, files), newest first; one year's worth, or the newest limit."""
+        query = "SELECT slug, title, post_date, files FROM posts"
+        params = []
+        if year == 'undated':
+            query += " WHERE post_date IS NULL OR post_date = ''"
+        elif year:
+            query += " WHERE post_date >= ? AND post_date < ?"
+            params += [year, str(int(year) + 1)]
+        query += " ORDER BY post_date DESC"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [
+            {'slug': slug, 'title': title, 'post_date': post_date, 'files': json.loads(files or '[]')}
+            for slug, title, post_date, files in rows
+        ]
+
+    def latest_post_date(self):
+        """Publish date ('YYYY-MM-DD') of the newest saved post, or None if nothing is saved yet."""
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(post_date) FROM posts").fetchone()
+        return row[0][:10] if row and row[0] else None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ArchiveIndex:
+    """Table of contents and Atom feed for one newsletter's saved posts, built from its manifest.
+
+    index.html lists the years with their post counts and links to one page per year
+    (index-2024.html, ...); feed.atom holds the newest posts. The manifest remembers when the
+    pages were last built, so an update only rewrites the pages of years that gained or
+    changed posts since then: a nightly sync that saves a few posts touches a few small
+    pages, however large the archive. A summary (index.json) is kept next to the manifest.
+    If library_root is given (the archive directory holding every newsletter), its
+    index.html, which lists the newsletters from those summaries, is refreshed too.
+    """
+
+    FEED_ENTRIES = 50
+    SUMMARY = "index.json"
+
+    def __init__(self, output_dir, base_url, manifest, pack=None, library_root=None):
+        self.output_dir = output_dir
+        self.library_root = library_root
+        self.base_url = base_url.rstrip('/')
+        self.domain = urlparse(self.base_url).netloc
+        self.manifest = manifest
+        # Pages are stored next to the posts: in the PackedArchive when packing
+        self.pack = pack
+
+    def _exists(self, name):
+        if self.pack:
+            return self.pack.exists(name)
+        return os.path.exists(os.path.join(self.output_dir, name))
+
+    def _write(self, name, text):
+        if self.pack:
+            self.pack.put(name, text)
+        else:
+            _write_atomically(os.path.join(self.output_dir, name), text)
+
+    @staticmethod
+    def _main_file(files):
+        # HTML when it was rendered, otherwise Markdown
+        for ext in ('.html', '.md'):
+            for name in files:
+                if name.endswith(ext) and not name.endswith(f'_transcript{ext}'):
+                    return name
+        return files[0] if files else None
+
+    def _page(self, title, body):
+        return (
+            f"<html><head><meta charset=\"utf-8\"><title>{html_escape(title)}</title>"
+            f'<link rel="alternate" type="application/atom+xml" href="feed.atom">{READER_CSS}</head>'
+            f"<body><h1>{html_escape(title)}</h1>\n{body}\n</body></html>\n"
+        )
+
+    def _post_items(self, posts):
+        items = []
+        for post in posts:
+            main = self._main_file(post['files'])
+            if not main:
+                continue
+            title = html_escape(post['title'] or post['slug'])
+            line = f'<li>{(post["post_date"] or "")[:10]} &middot; <a href="{quote(main)}">{title}</a>'
+            transcript = next((name for name in post['files'] if '_transcript.' in name), None)
+            if transcript:
+                line += f' (<a href="{quote(transcript)}">transcript</a>)'
+            items.append(line + "</li>")
+        return "<ul>\n" + "\n".join(items) + "\n</ul>"
+
+    def update(self):
+        """Bring index.html, the changed year pages and feed.atom up to date. Returns the years rebuilt."""
+        built_at = self.manifest.get_state('index_built_at')
+        saved_at = self.manifest.latest_saved_at()
+        if not self._exists('index.html'):
+            built_at = None
+        elif saved_at == built_at:
+            return []
+
+        counts = self.manifest.year_counts()
+        known_years = {year for year, _count in counts}
+        changed = [year for year in self.manifest.changed_years(built_at) if year in known_years]
+        for year in changed:
+            self._write(f"index-{year}.html", self._page(
+                f"{self.domain} - {year}",
+                '<p><a href="index.html">All years</a></p>\n' + self._post_items(self.manifest.listing(year=year)),
+            ))
+
+        total = sum(count for _year, count in counts)
+        years = "\n".join(
+            f'<li><a href="index-{year}.html">{year}</a> ({count} posts)</li>' for year, count in counts
+        )
+        latest = self.manifest.listing(limit=10)
+        self._write("index.html", self._page(self.domain, (
+            f'<p>{total} posts &middot; <a href="{html_escape(self.base_url)}">{html_escape(self.base_url)}</a>'
+            f' &middot; <a href="feed.atom">Atom feed</a></p>\n'
+            f"<h2>Latest</h2>\n{self._post_items(latest)}\n<h2>By year</h2>\n<ul>\n{years}\n</ul>"
+        )))
+        self._write("feed.atom", self._feed(self.manifest.listing(limit=self.FEED_ENTRIES)))
+
+        _write_atomically(os.path.join(self.output_dir, self.SUMMARY), json.dumps({
+            'domain': self.domain,
+            'url': self.base_url,
+            'posts': total,
+            'latest_post_date': latest[0]['post_date'] if latest else None,
+            'latest_title': latest[0]['title'] if latest else None,
+            'updated_at': datetime.now(timezone.utc).isoformat(),
+        }, indent=2))
+        self.manifest.set_state('index_built_at', saved_at)
+        if self.library_root:
+            write_library_index(self.library_root)
+        return changed
+
+    def _feed(self, posts):
+        updated = (posts[0]['post_date'] if posts else None) or datetime.now(timezone.utc).isoformat()
+        lines = [
+            '<?xml version="1.0" encoding="utf-8"?>',
+            '<feed xmlns="http://www.w3.org/2005/Atom">',
+            f"  <title>{xml_escape(self.domain)}</title>",
+            f"  <id>{xml_escape(self.base_url)}/</id>",
+            f"  <updated>{xml_escape(updated)}</updated>",
+            '  <link rel="self" href="feed.atom"/>',
+            f'  <link rel="related" href="{xml_escape(self.base_url)}"/>',
+        ]
+        for post in posts:
+            main = self._main_file(post['files'])
+            if not main:
+                continue
+            # Relative links resolve against the feed's location, i.e. the local files
+            lines += [
+                "  <entry>",
+                f"    <title>{xml_escape(post['title'] or post['slug'])}</title>",
+                f"    <id>{xml_escape(self.base_url)}/p/{xml_escape(post['slug'])}</id>",
+                f"    <updated>{xml_escape(post['post_date'] or updated)}</updated>",
+                f'    <link rel="alternate" href="{xml_escape(quote(main))}"/>',
+                f'    <link rel="related" href="{xml_escape(self.base_url)}/p/{xml_escape(post["slug"])}"/>',
+                "  </entry>",
+            ]
+        lines.append("</feed>")
+        return "\n".join(lines) + "\n"
+
+
+# Newsletters in one directory (batch workers) update the library index from their own threads
+_library_index_lock = threading.Lock()
+
+
+def write_library_index(root):
+    """Write root/index.html, listing every newsletter below root from its index.json summary."""
+    with _library_index_lock:
+        summaries = []
+        for name in sorted(os.listdir(root)):
+            path = os.path.join(root, name, ArchiveIndex.SUMMARY)
+            if os.path.isfile(path):
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        summaries.append((name, json.load(f)))
+                except (OSError, ValueError):
                     continue
-                    
-                # Small delay to be nice
-                time.sleep(1)
-                
-                full_post = self.get_post(slug)
-                if full_post:
-                    self.save_post(full_post, output_dir, html_only=html_only, md_only=md_only)
-                    total_fetched += 1
-            
-            # Since we might skip posts, we can't just rely on total_fetched for offset
-            # We must consistently move the offset by the number of posts fetched from API
-            offset += len(posts)
-            
-            if len(posts) < batch_limit:  # No more posts (checked against what we asked for)
-                break
+        summaries.sort(key=lambda item: item[1].get('latest_post_date') or '', reverse=True)
+        items = "\n".join(
+            f'<li><a href="{quote(name)}/index.html">{html_escape(summary.get("domain") or name)}</a> '
+            f'({summary.get("posts", 0)} posts, latest {(summary.get("latest_post_date") or "")[:10]}: '
+            f'{html_escape(summary.get("latest_title") or "")}) &middot; <a href="{quote(name)}/feed.atom">feed</a></li>'
+            for name, summary in summaries
+        )
+        _write_atomically(os.path.join(root, "index.html"), (
+            f"<html><head><meta charset=\"utf-8\"><title>Substack archive</title>{READER_CSS}</head>"
+            f"<body><h1>Substack archive</h1>\n<ul>\n{items}\n</ul>\n</body></html>\n"
+        ))
+
+
+class SearchIndex:
+    """SQLite FTS5 full-text index over every saved post, across all newsletters.
+
+    Posts are added (or replaced) one at a time as they are written, so keeping the index
+    current costs a single row update per post rather than a rebuild. A plain side table
+    maps (domain, slug) to the FTS rowid, so replacing a post doesn't scan the index.
+    """
+
+    FILENAME = "search.sqlite3"
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        # Batch runs write from several pipelines at once; other processes may hold the file briefly
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS posts USING fts5(
+                title,
+                body,
+                transcript,
+                domain UNINDEXED,
+                slug UNINDEXED,
+                post_date UNINDEXED,
+                path UNINDEXED,
+                tokenize = 'porter unicode61'
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                domain TEXT,
+                slug TEXT,
+                doc_id INTEGER,
+                PRIMARY KEY (domain, slug)
+            )
+        """)
+        self._conn.commit()
+
+    def add(self, domain, post, text, path):
+        """Index (or re-index) a post. text holds the body (and transcript) as plain text."""
+        slug = post.get('slug')
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT doc_id FROM documents WHERE domain = ? AND slug = ?", (domain, slug)
+            ).fetchone()
+            if row:
+                self._conn.execute("DELETE FROM posts WHERE rowid = ?", (row[0],))
+            cursor = self._conn.execute(
+                "INSERT INTO posts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    post.get('title') or '',
+                    text.get('body', ''),
+                    text.get('transcript', ''),
+                    domain,
+                    slug,
+                    (post.get('post_date') or '')[:10],
+                    path,
+                ),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?)", (domain, slug, cursor.lastrowid)
+            )
+            self._conn.commit()
+
+    def search(self, query, limit=20, domain=None):
+        """Return the best matches for an FTS5 query as dicts, best first.
+
+        Title matches are weighted above body and transcript matches. A query that isn't
+        valid FTS5 syntax is retried as a plain list of words.
+        """
+        sql = """
+            SELECT title, domain, slug, post_date, path,
+                   snippet(posts, -1, '[', ']', '...', 16),
+                   bm25(posts, 10.0, 1.0, 1.0) AS score
+            FROM posts
+            WHERE posts MATCH ?
+        """
+        params = [query]
+        if domain:
+            sql += " AND domain = ?"
+            params.append(domain)
+        sql += " ORDER BY score LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            try:
+                rows = self._conn.execute(sql, params).fetchall()
+            except sqlite3.OperationalError:
+                params[0] = " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+                rows = self._conn.execute(sql, params).fetchall()
+        columns = ('title', 'domain', 'slug', 'post_date', 'path', 'snippet', 'score')
+        return [dict(zip(columns, row)) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_search_index(path):
+    """Open the SearchIndex at path, or return None (with a message) if SQLite was built without FTS5."""
+    probe = sqlite3.connect(':memory:')
+    try:
+        probe.execute("CREATE VIRTUAL TABLE probe USING fts5(body)")
+    except sqlite3.OperationalError:
+        print("Full-text search is unavailable: this Python's SQLite was built without FTS5.")
+        return None
+    finally:
+        probe.close()
+    return SearchIndex(path)
+
+
+class _ImageSourceScanner(HTMLParser):
+    """Collects <img> sources (and their srcsets) and <a> hrefs without building a document tree."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.sources = []
+        self.srcsets = {}
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            href = dict(attrs).get('href')
+            if href:
+                self.links.append(href)
+        elif tag == 'img':
+            attrs = dict(attrs)
+            src = attrs.get('src')
+            if src:
+                self.sources.append(src)
+                if attrs.get('srcset'):
+                    self.srcsets.setdefault(src, attrs['srcset'])
+
+    handle_startendtag = handle_starttag
+
+
+def scan_html(html):
+    """Scan an HTML fragment once, returning a scanner with .sources, .srcsets and .links."""
+    scanner = _ImageSourceScanner()
+    scanner.feed(html)
+    scanner.close()
+    return scanner
+
+
+def scan_image_sources(html):
+    """Return the src of every <img> in an HTML fragment, in document order, and a map of src -> srcset."""
+    scanner = scan_html(html)
+    return scanner.sources, scanner.srcsets
+
+
+def _bare_host(netloc):
+    netloc = netloc.lower()
+    return netloc[4:] if netloc.startswith('www.') else netloc
+
+
+def post_link_slug(href, domain):
+    """Return the slug if href points at a post (/p/<slug>) on domain, else None."""
+    parsed = urlparse(href)
+    if parsed.scheme not in ('http', 'https') or _bare_host(parsed.netloc) != _bare_host(domain):
+        return None
+    if not parsed.path.startswith('/p/'):
+        return None
+    slug = parsed.path[3:].strip('/')
+    return slug if slug and '/' not in slug else None
+
+
+def resolve_post_links(hrefs, domain, filename_bases):
+    """Split a post's links to other posts into ({href: filename_base} for saved posts, [(slug, href)] for the rest)."""
+    link_map = {}
+    unresolved = []
+    for href in dict.fromkeys(hrefs):
+        slug = post_link_slug(href, domain)
+        if not slug:
+            continue
+        if slug in filename_bases:
+            link_map[href] = filename_bases[slug]
+        else:
+            unresolved.append((slug, href))
+    return link_map, unresolved
+
+
+def _local_link(href, filename_base, ext):
+    fragment = urlparse(href).fragment
+    return f"{filename_base}{ext}" + (f"#{fragment}" if fragment else "")
+
+
+class CrossLinks:
+    """Keeps links between posts of one newsletter pointing at the local files.
+
+    An in-memory slug -> filename_base map of every saved post (seeded from the manifest)
+    lets the renderer rewrite each /p/<slug> link with a dict lookup. Links to posts that
+    aren't saved yet keep their web URL and are recorded in the manifest; once the target
+    is saved, just the files linking to it are patched with a plain text replacement,
+    without re-parsing anything.
+    """
+
+    def __init__(self, manifest, domain, output_dir, pack=None):
+        self.manifest = manifest
+        self.domain = domain
+        self.output_dir = output_dir
+        self.pack = pack
+        self.filename_bases = manifest.saved_filename_bases()
+        self._lock = threading.Lock()
+
+    def resolve(self, hrefs):
+        with self._lock:
+            return resolve_post_links(hrefs, self.domain, self.filename_bases)
+
+    def saved(self, slug, filename_base, files, unresolved):
+        """Record a newly written post: patch files waiting for it, and remember its own unresolved links."""
+        with self._lock:
+            self.filename_bases[slug] = filename_base
+            pending = []
+            for target, href in unresolved:
+                # The target may have been saved while this post was rendering
+                if target in self.filename_bases:
+                    self._patch(files, href, self.filename_bases[target])
+                else:
+                    pending.append((target, href))
+            self.manifest.set_pending_links(slug, pending)
+            for source_files, href in self.manifest.pop_pending_links(slug):
+                self._patch(source_files, href, filename_base)
+
+    def _read(self, name):
+        if self.pack:
+            data = self.pack.get(name)
+            return data.decode('utf-8') if data is not None else None
+        path = os.path.join(self.output_dir, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def _write(self, name, text):
+        if self.pack:
+            self.pack.put(name, text)
+            return
+        tmp_path = os.path.join(self.output_dir, f".{name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, os.path.join(self.output_dir, name))
+
+    def _patch(self, files, href, filename_base):
+        for name in files:
+            if name.endswith('.html'):
+                # Attribute values are serialized with &, < and > escaped
+                escaped = href.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+                replacements = [(f'href="{escaped}"', f'href="{_local_link(href, filename_base, ".html")}"')]
+            elif name.endswith('.md'):
+                local = _local_link(href, filename_base, '.md')
+                replacements = [(f"]({href})", f"]({local})"), (f']({href} "', f']({local} "')]
+                # markdownify writes a link whose text is its URL as an autolink, <href>
+                replacements.append((f"<{href}>", f"[{href}]({local})"))
+            else:
+                continue
+            text = self._read(name)
+            if text is None:
+                continue
+            patched = text
+            for old, new in replacements:
+                patched = patched.replace(old, new)
+            if patched != text:
+                self._write(name, patched)
+
+
+def parse_srcset(srcset):
+    """Return the (url, width) candidates of a srcset that uses width descriptors."""
+    # CDN URLs contain commas themselves, so split on "URL <n>w" pairs rather than on commas
+    return [(url.lstrip(','), int(width)) for url, width in re.findall(r'(\S+)\s+(\d+)w', srcset or '')]
+
+
+def sized_image_url(src, srcset=None, width=None):
+    """Pick the variant of an image closest to (but not narrower than) width.
+
+    Uses the srcset candidates if there are any, otherwise asks Substack's CDN for a
+    resized copy. Without a width, or for other hosts, src is returned unchanged.
+    """
+    if not width:
+        return src
+    candidates = parse_srcset(srcset)
+    if candidates:
+        wide_enough = [candidate for candidate in candidates if candidate[1] >= width]
+        return min(wide_enough, key=lambda c: c[1])[0] if wide_enough else max(candidates, key=lambda c: c[1])[0]
+
+    if SUBSTACK_CDN_FETCH not in src:
+        return src
+    prefix, rest = src.split(SUBSTACK_CDN_FETCH, 1)
+    options, slash, original = rest.partition('/')
+    if not slash or '://' in options or '%3A' in options:
+        # No transformation segment; the original URL follows directly
+        return f"{prefix}{SUBSTACK_CDN_FETCH}w_{width},c_limit/{rest}"
+    match = re.search(r'(?:^|,)w_(\d+)', options)
+    if match:
+        if int(match.group(1)) <= width:
+            return src
+        options = re.sub(r'(^|,)w_\d+', rf'\g<1>w_{width}', options, count=1)
+    else:
+        options = f"w_{width},c_limit,{options}"
+    return f"{prefix}{SUBSTACK_CDN_FETCH}{options}/{original}"
+
+
+def transcode_image(path, image_format, max_width=None, max_bytes=None):
+    """Re-encode an image as WebP or AVIF, no wider than max_width and (if possible) within max_bytes.
+
+    Returns the path of the new file, or None to keep the original: when Pillow can't
+    read or write it (SVG, animations, a missing AVIF codec) or the result isn't smaller.
+    Runs in a worker process.
+    """
+    out_path = f"{path}.{image_format}"
+    try:
+        with Image.open(path) as image:
+            if getattr(image, 'is_animated', False):
+                return None
+            image.load()
+            if max_width and image.width > max_width:
+                image = image.resize((max_width, max(1, round(image.height * max_width / image.width))), Image.LANCZOS)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if image.mode in ('LA', 'P', 'PA') else 'RGB')
+            for quality in TRANSCODE_QUALITIES:
+                image.save(out_path, format=image_format.upper(), quality=quality)
+                if not max_bytes or os.path.getsize(out_path) <= max_bytes:
+                    break
+        if os.path.getsize(out_path) >= os.path.getsize(path):
+            os.remove(out_path)
+            return None
+        return out_path
+    except Exception:
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        return None
+
+
+# Void in HTML5, but parsed as containers by libxml2 2.14+: <picture><source><img></picture>
+# comes back as <source><img/></source>
+LXML_VOID_ELEMENTS = ['source', 'track', 'wbr', 'embed']
+
+
+def parse_html(html):
+    """Parse an HTML fragment with the fastest parser available."""
+    soup = BeautifulSoup(html, HTML_PARSER)
+    if HTML_PARSER != 'html.parser':
+        # lxml wraps fragments in <html><body> and moves leading <style>, <meta> and <title>
+        # into a <head>; unwrap them all, and move anything nested in a void element back
+        # out after it, so the tree matches html.parser's
+        for tag in soup.find_all(['html', 'head', 'body']):
+            tag.unwrap()
+        for tag in soup.find_all(LXML_VOID_ELEMENTS):
+            for child in reversed(list(tag.contents)):
+                tag.insert_after(child.extract())
+    return soup
+
+
+@contextmanager
+def _timed(timings, phase):
+    # Accumulates into a plain dict so it can travel back from a render process
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - started
+
+
+def _write_output(output_dir, name, data, timings=None, contents=None):
+    # With a packed archive the caller stores the collected contents; otherwise write the file
+    if contents is not None:
+        contents[name] = data
+        return
+    with _timed(timings, 'disk_write'):
+        with open(os.path.join(output_dir, name), 'w', encoding='utf-8') as f:
+            f.write(data)
+
+
+# Modern, Reader-Mode style CSS, shared by posts and the archive's index pages
+READER_CSS = """
+        <style>
+            body {
+                font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif;
+                line-height: 1.6;
+                color: #333;
+                max-width: 800px;
+                margin: 0 auto;
+                padding: 20px;
+            }
+            img {
+                max-width: 100%;
+                height: auto;
+                display: block;
+                margin: 20px auto;
+                border-radius: 8px;
+            }
+            h1 {
+                font-size: 2.2em;
+                margin-bottom: 0.5em;
+                color: #1a1a1a;
+            }
+            a {
+                color: #0066cc;
+                text-decoration: none;
+            }
+            a:hover {
+                text-decoration: underline;
+            }
+            pre {
+                background: #f4f4f4;
+                padding: 15px;
+                border-radius: 5px;
+                overflow-x: auto;
+            }
+            blockquote {
+                border-left: 4px solid #ddd;
+                margin: 0;
+                padding-left: 15px;
+                color: #666;
+            }
+            audio {
+                width: 100%;
+                margin: 20px 0;
+            }
+        </style>
+        """
+
+
+def render_post(job, base_url, html_only=False, md_only=False, timings=None, text=None, contents=None):
+    """Render a post whose assets have been fetched and write it to disk. Returns the files written.
+
+    The body is parsed exactly once and serialized once per output format, so this is
+    safe and cheap to run in a worker process. If a timings dict is given, seconds spent in
+    html_parse, html_render, markdownify and disk_write are added to it. If a text dict is
+    given, the plain text of the body (and transcript) is stored in it for the search index.
+    If a contents dict is given, files are collected there (name -> text) instead of written.
+    """
+    output_dir = job['output_dir']
+    date = job['date']
+    slug = job['slug']
+    title = job['title']
+    filename_base = job['filename_base']
+    audio_filename = job['audio_filename']
+    written = []
+
+    with _timed(timings, 'html_parse'):
+        soup = parse_html(job['html'])
+        image_map = job['image_map']
+        for img in soup.find_all('img'):
+            src = img.get('src')
+            if src and src in image_map:
+                # Update HTML src to point to local file (relative path)
+                img['src'] = image_map[src]
+                # Remove srcset to force browser to use src
+                if img.has_attr('srcset'):
+                    del img['srcset']
+
+        transcript_soup = parse_html(job['transcript_html']) if job['transcript_html'] else None
+
+        # Links to other saved posts of this newsletter point at the local file of each output format
+        local_links = []
+        link_map = job.get('link_map')
+        if link_map:
+            for a in soup.find_all('a', href=True):
+                filename_base_target = link_map.get(a['href'])
+                if filename_base_target:
+                    local_links.append((a, a['href'], filename_base_target))
+
+    if text is not None:
+        with _timed(timings, 'text_extract'):
+            text['body'] = soup.get_text(" ", strip=True)
+            if transcript_soup:
+                text['transcript'] = transcript_soup.get_text(" ", strip=True)
+
+    # 1. Save HTML (if not disabled)
+    if not md_only:
+        css = READER_CSS
+        
+        for a, href, target in local_links:
+            a['href'] = _local_link(href, target, '.html')
+        with _timed(timings, 'html_render'):
+            html_body = soup.prettify()
+        if audio_filename:
+            html_body = f'<audio controls src="assets/{audio_filename}"></audio>\n' + html_body
+
+        # We save the modified soup with local image links
+        full_html = f"<html><head><title>{title}</title>{css}</head><body><h1>{title}</h1>{html_body}</body></html>"
+        _write_output(output_dir, f"{filename_base}.html", full_html, timings, contents)
+        written.append(f"{filename_base}.html")
+
+        if transcript_soup:
+            with _timed(timings, 'html_render'):
+                transcript_body = transcript_soup.prettify()
+            full_transcript_html = f"<html><head><title>{title} - Transcript</title>{css}</head><body><h1>{title} - Transcript</h1>{transcript_body}</body></html>"
+            _write_output(output_dir, f"{filename_base}_transcript.html", full_transcript_html, timings, contents)
+            written.append(f"{filename_base}_transcript.html")
+
+    # 2. Save Markdown (if not disabled)
+    if not html_only:
+        converter = MarkdownConverter(heading_style="ATX")
+
+        # Convert the MODIFIED soup (with local links) to Markdown
+        # This ensures the markdown points to assets/image.jpg
+        for a, href, target in local_links:
+            a['href'] = _local_link(href, target, '.md')
+        with _timed(timings, 'markdownify'):
+            md_content = converter.convert_soup(soup)
+        
+        # Add metadata header
+        full_md = f"# {title}\n\nDate: {date}\nURL: {base_url}/p/{slug}\n\n"
+        if audio_filename:
+            full_md += f"**Audio:** [Listen locally](assets/{audio_filename})\n\n"
+        full_md += md_content
+        
+        _write_output(output_dir, f"{filename_base}.md", full_md, timings, contents)
+        written.append(f"{filename_base}.md")
+
+        if transcript_soup:
+            with _timed(timings, 'markdownify'):
+                transcript_md = converter.convert_soup(transcript_soup)
+            _write_output(output_dir, f"{filename_base}_transcript.md", f"# {title} - Transcript\n\n{transcript_md}", timings, contents)
+            written.append(f"{filename_base}_transcript.md")
+
+    return written
+
+
+def _process_pool(processes, initializer=None, initargs=()):
+    # Spawn rather than fork: the pipeline already has threads (and their locks) running
+    return ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=initializer,
+        initargs=initargs,
+    )
+
+
+def _refuse_in_spawned_worker():
+    # A spawned process re-runs the calling script as __mp_main__ before it can work. A
+    # script without an `if __name__ == "__main__":` guard would start a whole scrape in
+    # every render process; fail instead, so the pool breaks and the parent renders in-process
+    # (_inheriting is multiprocessing's own flag for this phase; see spawn._check_not_importing_main)
+    if getattr(multiprocessing.current_process(), '_inheriting', False):
+        raise RuntimeError('a worker process is re-running the calling script; guard it with `if __name__ == "__main__":`')
+
+
+_broken_pool_reported = False
+
+
+def _report_broken_pool():
+    global _broken_pool_reported
+    if not _broken_pool_reported:
+        _broken_pool_reported = True
+        print('Worker processes could not start (does the calling script lack an `if __name__ == "__main__":` guard?); '
+              'rendering in this process instead.')
+
+
+def _run_in_pool(pool, func, *args):
+    """pool.submit(func, *args).result(), or func(*args) in this process if the pool's workers can't run."""
+    try:
+        return pool.submit(func, *args).result()
+    except BrokenProcessPool:
+        _report_broken_pool()
+        return func(*args)
+
+
+def _map_in_pool(pool, func, tasks, chunksize=1, initializer=None, initargs=()):
+    """pool.map over a list of tasks, finishing in this process (after initializer) if the pool breaks."""
+    done = 0
+    try:
+        for result in pool.map(func, tasks, chunksize=chunksize):
+            done += 1
+            yield result
+        return
+    except BrokenProcessPool:
+        _report_broken_pool()
+    if initializer:
+        initializer(*initargs)
+    for task in tasks[done:]:
+        yield func(task)
+
+
+def _profiled(profile_dir, func, *args, **kwargs):
+    """Call func, under cProfile if profile_dir is set (one stats file per call, merged by the parent)."""
+    if not profile_dir:
+        return func(*args, **kwargs)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(os.path.join(profile_dir, f"render-{os.getpid()}-{uuid.uuid4().hex}.prof"))
+
+
+def _render_job(job, base_url, html_only, md_only, profile_dir=None, extract_text=False, collect=False):
+    timings = {}
+    text = {} if extract_text else None
+    contents = {} if collect else None
+    files = _profiled(profile_dir, render_post, job, base_url, html_only=html_only, md_only=md_only,
+                      timings=timings, text=text, contents=contents)
+    return files, timings, text, contents
+
+
+# Each render process builds its own offline scraper once and reuses it for every post
+_render_scraper = None
+
+
+_render_filename_bases = {}
+
+
+def _init_render_worker(base_url, asset_store_dir, raw_cache_dir, pack_path=None, filename_bases=None, image_options=None):
+    global _render_scraper, _render_filename_bases
+    # image_options (width, format, max bytes) decide the asset store keys of images saved without a manifest entry
+    _render_scraper = SubstackScraper(
+        base_url, asset_store_dir=asset_store_dir, raw_cache_dir=raw_cache_dir, pack_path=pack_path, **(image_options or {})
+    )
+    _render_filename_bases = filename_bases or {}
+
+
+def _render_cached_post(task):
+    slug, output_dir, html_only, md_only, profile_dir, extract_text, saved_images = task
+    collect = _render_scraper.pack is not None
+    try:
+        post = _render_scraper.raw_cache.get('posts', slug)
+        job = _render_scraper.parse_post(post, output_dir)
+        if not job:
+            return None
+        _render_scraper.attach_cached_assets(job, saved_images)
+        job['link_map'], unresolved = resolve_post_links(job['links'], _render_scraper.domain, _render_filename_bases)
+        files, timings, text, contents = _render_job(
+            job, _render_scraper.base_url, html_only, md_only, profile_dir, extract_text, collect
+        )
+        return post, files, job['assets'], job['image_map'], timings, text, contents, job['filename_base'], unresolved
+    except Exception as e:
+        print(f"Error rendering {slug}: {e}")
+        return None
+
+
+def search_archive(query, limit=20, domain=None, archive_dir="archive"):
+    """Print the best matches for a query across every downloaded newsletter (or just one domain)."""
+    index_path = os.path.join(archive_dir, SearchIndex.FILENAME)
+    if not os.path.exists(index_path):
+        print(f"No search index at {index_path} yet; download or render some posts first.")
+        return []
+    index = open_search_index(index_path)
+    if index is None:
+        return []
+    try:
+        started = time.perf_counter()
+        results = index.search(query, limit=limit, domain=domain)
+        elapsed = time.perf_counter() - started
+    finally:
+        index.close()
+
+    for number, result in enumerate(results, 1):
+        print(f"{number}. {result['title']} ({result['domain']}, {result['post_date']})")
+        print(f"   {os.path.join(archive_dir, result['path'])}")
+        print(f"   {result['snippet']}")
+    print(f"{len(results)} results in {elapsed * 1000:.1f} ms.")
+    return results
+
+
+def find_session_file(domain):
+    """Return the login.py session file for a domain (substack_session_{domain}.json, then substack_session.json), or None."""
+    for path in (f"substack_session_{domain}.json", "substack_session.json"):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def dates_are_valid(*values):
+    """Check YYYY-MM-DD date options (or since='last'), printing a message for the first bad one."""
+    for value in values:
+        if value and value != 'last':
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                print(f"Invalid date {value!r}, expected YYYY-MM-DD.")
+                return False
+    return True
+
+
+# Options a batch config can set globally (under "defaults") or per newsletter
+BATCH_DEFAULTS = {
+    'sync': True,
+    'limit': None,
+    'since': None,
+    'until': None,
+    'search': '',
+    'slugs': None,
+    'skip_podcasts': False,
+    'html_only': False,
+    'md_only': False,
+    'rate': 2.0,
+    'concurrency': 4,
+    'fetch_workers': 4,
+    'asset_workers': 4,
+    'audio_segments': 1,
+    'pack': False,
+    'image_width': None,
+    'image_format': None,
+    'image_max_bytes': None,
+}
+
+
+def _scrape_newsletter(entry, shared, output_root, asset_store_dir, position):
+    """Scrape one newsletter of a batch run. Returns a summary dict for the batch report."""
+    options = dict(BATCH_DEFAULTS, **entry)
+    url = options['url']
+    domain = urlparse(url).netloc
+    output_dir = options.get('output_dir') or os.path.join(output_root, domain)
+    started = time.perf_counter()
+    summary = {'url': url, 'output_dir': output_dir, 'posts': 0, 'error': None}
+    scraper = None
+    try:
+        if not dates_are_valid(options['since'], options['until']):
+            raise ValueError(f"invalid --since/--until for {url}")
+
+        cookie = options.get('cookie') or (os.getenv(options['cookie_env']) if options.get('cookie_env') else None)
+        scraper = SubstackScraper(
+            url,
+            cookie,
+            fetch_workers=options['fetch_workers'],
+            asset_workers=options['asset_workers'],
+            rate=options['rate'],
+            concurrency=options['concurrency'],
+            asset_store_dir=asset_store_dir,
+            raw_cache_dir=os.path.join(output_dir, ".raw"),
+            audio_segments=options['audio_segments'],
+            shared=shared,
+            search_index=shared.search_index,
+            library_root=output_root,
+            pack_path=os.path.join(output_dir, PackedArchive.FILENAME) if options['pack'] else None,
+            image_width=options['image_width'],
+            image_format=options['image_format'],
+            image_max_bytes=options['image_max_bytes'],
+        )
+        scraper.progress_label = domain
+        scraper.progress_position = position
+        if not cookie:
+            session_file = options.get('session_file') or find_session_file(domain)
+            if session_file:
+                scraper.load_session_file(session_file)
+
+        summary['posts'] = scraper.scrape(
+            output_dir,
+            limit=options['limit'],
+            skip_podcasts=options['skip_podcasts'],
+            html_only=options['html_only'],
+            md_only=options['md_only'],
+            sync=options['sync'],
+            since=options['since'],
+            until=options['until'],
+            search=options['search'],
+            slugs=options['slugs'],
+            # An unreachable archive must show up as this newsletter's error, not as 0 posts
+            strict=True,
+        )
+    except Exception as e:
+        # One broken newsletter must not stop the rest of the batch
+        print(f"Error scraping {url}: {e}")
+        summary['error'] = str(e)
+    finally:
+        if scraper:
+            scraper.close()
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def run_batch(config_path, report_path=None, prom_path=None):
+    """Scrape every newsletter listed in a JSON config in one process.
+
+    Newsletters run side by side (up to "workers" at once) and share one rate limiter,
+    connection pool, image executor and render process pool, so a full sync takes about
+    as long as the slowest newsletter rather than the sum of all of them. Each newsletter's
+    API host keeps its own rate and concurrency cap.
+    """
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    newsletters = config.get('newsletters', [])
+    if not newsletters:
+        print(f"No newsletters listed in {config_path}.")
+        return []
+    defaults = config.get('defaults', {})
+    entries = [dict(defaults, **entry) for entry in newsletters]
+
+    output_root = config.get('output_dir', "archive")
+    shared = SharedResources(
+        image_workers=config.get('image_workers', 16),
+        render_workers=config.get('render_workers'),
+        asset_rate=config.get('asset_rate', 20.0),
+        retries=config.get('retries', 5),
+        asset_concurrency=config.get('asset_concurrency'),
+        hosts=len(entries),
+        search_index=open_search_index(os.path.join(output_root, SearchIndex.FILENAME)),
+        transport=config.get('transport', 'http1'),
+    )
+    workers = max(1, min(config.get('workers', 4), len(entries)))
+    print(f"Scraping {len(entries)} newsletters, {workers} at a time...")
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            summaries = list(executor.map(
+                lambda item: _scrape_newsletter(item[1], shared, output_root, config.get('asset_store'), item[0]),
+                enumerate(entries),
+            ))
+    finally:
+        shared.close()
+
+    failed = [summary for summary in summaries if summary['error']]
+    print(f"\nBatch complete: {sum(summary['posts'] or 0 for summary in summaries)} posts from {len(entries)} newsletters"
+          f"{f', {len(failed)} failed' if failed else ''}.")
+    for summary in failed:
+        print(f"  {summary['url']}: {summary['error']}")
+
+    if report_path:
+        shared.metrics.write_json(report_path, newsletters=summaries)
+        print(f"Run report saved to {report_path}")
+    if prom_path:
+        shared.metrics.write_prometheus(prom_path, labels={'newsletter': 'batch'})
+        print(f"Prometheus metrics saved to {prom_path}")
+    return summaries
 
-        print(f"Scraping complete. Downloaded {total_fetched} posts.")
 
 def main():
     parser = argparse.ArgumentParser(description="Scrape a Substack newsletter.")
-    parser.add_argument("--url", required=True, help="Base URL of the Substack (e.g., https://read.substack.com)")
+    parser.add_argument("command", nargs="?", default="download", choices=["download", "render", "batch", "search", "export", "export-epub"],
+                        help="download (default) fetches posts; render rebuilds HTML/Markdown from the local raw cache without network access; "
+                             "batch scrapes every newsletter in --config; search queries the full-text index of everything downloaded; "
+                             "export expands a --pack archive back into files; export-epub builds an e-book from the saved posts")
+    parser.add_argument("query", nargs="?", help="Search query for the search command (FTS5 syntax: words, \"phrases\", OR, NOT, prefix*)")
+    parser.add_argument("--url", help="Base URL of the Substack (e.g., https://read.substack.com)")
+    parser.add_argument("--config", help="JSON file listing the newsletters for the batch command")
+    parser.add_argument("--results", type=int, default=20, help="Number of search results to show (default: 20)")
+    parser.add_argument("--pack", action="store_true", help=f"Store posts, images and raw responses in one file ({PackedArchive.FILENAME}) instead of thousands of small files")
+    parser.add_argument("--to", help="Where to export: the directory to expand a packed archive into (default: the newsletter's archive directory), "
+                                     "or the .epub file for export-epub (default: archive/<domain>.epub)")
+    parser.add_argument("--split-by-year", action="store_true", help="With export-epub, write one book per year (the year is added to the file name)")
     parser.add_argument("--cookie", help="substack.sid cookie (optional, overrides .env)")
     parser.add_argument("--limit", type=int, help="Limit number of posts to scrape")
     parser.add_argument("--skip-podcasts", action="store_true", help="Skip downloading podcast episodes")
     parser.add_argument("--html-only", action="store_true", help="Save only HTML files")
     parser.add_argument("--md-only", action="store_true", help="Save only Markdown files")
+    parser.add_argument("--since", help="Only posts published on or after this date (YYYY-MM-DD), or 'last' for everything since the newest saved post")
+    parser.add_argument("--until", help="Only posts published on or before this date (YYYY-MM-DD)")
+    parser.add_argument("--slug", action="append", dest="slugs", help="Download this post (repeatable); skips the archive listing")
+    parser.add_argument("--search", default="", help="Only posts matching this search term (uses Substack's archive search)")
+    parser.add_argument("--sync", action="store_true", help="Download every post that is new or changed since the last run, skipping the range prompt")
+    parser.add_argument("--asset-store", help="Shared directory for downloaded images/audio, deduplicated across newsletters")
+    parser.add_argument("--image-width", type=int, help="Download images at about this width (e.g. 1600): picks the closest srcset candidate or asks Substack's CDN for a resized copy")
+    parser.add_argument("--image-format", choices=["webp", "avif"], help="Re-encode downloaded images in this format (needs Pillow)")
+    parser.add_argument("--image-max-bytes", type=int, help="With --image-format, lower the quality until each image fits in this many bytes")
+    parser.add_argument("--audio-segments", type=int, default=1, help="Download each podcast file as this many parallel byte ranges (default: 1)")
+    parser.add_argument("--image-workers", type=int, default=8, help="Number of images to download in parallel (default: 8)")
+    parser.add_argument("--fetch-workers", type=int, default=4, help="Number of posts to fetch from the API in parallel (default: 4)")
+    parser.add_argument("--asset-workers", type=int, default=4, help="Number of posts fetching their images/audio at the same time (default: 4)")
+    parser.add_argument("--rate", type=float, default=2.0, help="Starting requests per second to the newsletter's API; adapts to throttling (default: 2)")
+    parser.add_argument("--asset-rate", type=float, default=20.0, help="Starting requests per second to image/audio hosts (default: 20)")
+    parser.add_argument("--transport", choices=TRANSPORTS, default="http1",
+                        help="http1 (default): requests/urllib3 keep-alive pools; http2: multiplex requests over HTTP/2 with httpx (pip install 'httpx[http2]')")
+    parser.add_argument("--retries", type=int, default=5, help="Retries for throttled (429) or failed (5xx) requests (default: 5)")
+    parser.add_argument("--render-workers", type=int, help="Number of processes rendering HTML/Markdown (default: one per CPU core)")
+    parser.add_argument("--report", help="Write per-phase timings and counters for this run to a JSON file")
+    parser.add_argument("--prom-file", help="Write the same metrics as a Prometheus textfile (for node_exporter's textfile collector)")
+    parser.add_argument("--profile", help="Run rendering under cProfile and save the merged stats to this file (view with pstats or snakeviz)")
     
     args = parser.parse_args()
 
+    if args.command == "search":
+        if not args.query:
+            parser.error("search needs a query")
+        search_archive(args.query, limit=args.results, domain=urlparse(args.url).netloc if args.url else None)
+        return
+    if args.command == "batch":
+        if not args.config:
+            parser.error("batch needs --config")
+        run_batch(args.config, report_path=args.report, prom_path=args.prom_file)
+        return
+    if not args.url:
+        parser.error("--url is required")
+
     # Priority:
     # 1. Command line cookie
     # 2. Session file (from login.py)
@@ -426,61 +3339,136 @@ def main():
     
     cookie = args.cookie
     
-    # Priority for session file:
-    # 1. substack_session_{domain}.json
-    # 2. substack_session.json
-    
-    from urllib.parse import urlparse
     domain = urlparse(args.url).netloc
-    
-    session_file_specific = f"substack_session_{domain}.json"
-    session_file_default = "substack_session.json"
-    
-    scraper = SubstackScraper(args.url, cookie)
-    
-    if not cookie:
-        if os.path.exists(session_file_specific):
-            scraper.load_session_file(session_file_specific)
-        elif os.path.exists(session_file_default):
-             scraper.load_session_file(session_file_default)
-        else:
-             cookie = os.getenv("SUBSTACK_SID")
-             if cookie:
-                 scraper = SubstackScraper(args.url, cookie)
-    
+
     # Create a nice output directory name from the URL
-    domain = urlparse(args.url).netloc
     output_dir = os.path.join("archive", domain)
     
-    # Fetch all metadata first
-    all_posts = scraper.get_all_archive_posts()
-    total_posts = len(all_posts)
-    print(f"\nTotal posts found: {total_posts}")
-    
-    if total_posts == 0:
-        return
+    scraper_options = {
+        'image_workers': args.image_workers,
+        'fetch_workers': args.fetch_workers,
+        'asset_workers': args.asset_workers,
+        'render_workers': args.render_workers,
+        'rate': args.rate,
+        'asset_rate': args.asset_rate,
+        'retries': args.retries,
+        'transport': args.transport,
+        'library_root': "archive",
+        'asset_store_dir': args.asset_store,
+        'audio_segments': args.audio_segments,
+        'raw_cache_dir': os.path.join(output_dir, ".raw"),
+        'profile_path': args.profile,
+        'pack_path': os.path.join(output_dir, PackedArchive.FILENAME) if args.pack else None,
+        'image_width': args.image_width,
+        'image_format': args.image_format,
+        'image_max_bytes': args.image_max_bytes,
+    }
 
-    try:
-        print(f"Enter the range of posts to download (1 is the oldest post).")
-        start_val = int(input(f"Start post (1-{total_posts}): "))
-        end_val = int(input(f"End post ({start_val}-{total_posts}): "))
-    except ValueError:
-        print("Invalid input. Please enter numbers.")
+    if args.command == "export":
+        pack_path = os.path.join(output_dir, PackedArchive.FILENAME)
+        if not os.path.exists(pack_path):
+            print(f"No packed archive at {pack_path}.")
+            return
+        pack = PackedArchive(pack_path)
+        try:
+            count = pack.export(args.to or output_dir)
+        finally:
+            pack.close()
+        print(f"Exported {count} files to {args.to or output_dir}.")
         return
 
-    if start_val < 1: start_val = 1
-    if end_val > total_posts: end_val = total_posts
-    if start_val > end_val:
-        print("Start must be <= End.")
+    if args.command == "export-epub":
+        if not os.path.exists(os.path.join(output_dir, Manifest.FILENAME)):
+            print(f"Nothing has been saved to {output_dir} yet.")
+            return
+        if not dates_are_valid(args.since, args.until):
+            return
+        # Imported here: only this command needs it
+        from epub import export_epub
+        books = export_epub(output_dir, args.url, path=args.to, since=args.since, until=args.until, split_by_year=args.split_by_year)
+        for book in books:
+            print(f"Wrote {book}")
+        if not books:
+            print("No saved posts with HTML files match; run without --md-only (or use render) first.")
         return
 
-    # Calculate slice (List is Newest(0) -> Oldest(N-1))
-    slice_start = total_posts - end_val
-    slice_end = total_posts - start_val + 1
+    # Opened only now: the export commands above don't touch it
+    scraper_options['search_index'] = open_search_index(os.path.join("archive", SearchIndex.FILENAME))
+    scraper = SubstackScraper(args.url, cookie, **scraper_options)
+
+    try:
+        if args.command == "render":
+            # Everything comes from the raw cache and asset store, so no session is needed
+            rendered = scraper.render_archive(output_dir, html_only=args.html_only, md_only=args.md_only)
+            print(f"Rendered {rendered} posts.")
+            return
+    
+        if not cookie:
+            # Session file from login.py: substack_session_{domain}.json, then substack_session.json
+            session_file = find_session_file(domain)
+            if session_file:
+                scraper.load_session_file(session_file)
+            else:
+                 cookie = os.getenv("SUBSTACK_SID")
+                 if cookie:
+                     scraper.close()
+                     scraper = SubstackScraper(args.url, cookie, **scraper_options)
+
+        if not dates_are_valid(args.since, args.until):
+            return
+
+        if args.sync or args.limit or args.since or args.until or args.slugs or args.search:
+            # No range prompt needed: stream the archive straight into the download pipeline,
+            # so the first posts are saved while later archive pages are still being fetched
+            scraper.scrape(
+                output_dir,
+                limit=args.limit,
+                skip_podcasts=args.skip_podcasts,
+                html_only=args.html_only,
+                md_only=args.md_only,
+                sync=args.sync,
+                since=args.since,
+                until=args.until,
+                search=args.search,
+                slugs=args.slugs,
+            )
+            return
+
+        # Fetch all metadata first
+        all_posts = scraper.get_all_archive_posts(output_dir)
+        total_posts = len(all_posts)
+        print(f"\nTotal posts found: {total_posts}")
+    
+        if total_posts == 0:
+            return
+
+        try:
+            print(f"Enter the range of posts to download (1 is the oldest post).")
+            start_val = int(input(f"Start post (1-{total_posts}): "))
+            end_val = int(input(f"End post ({start_val}-{total_posts}): "))
+        except ValueError:
+            print("Invalid input. Please enter numbers.")
+            return
+
+        if start_val < 1: start_val = 1
+        if end_val > total_posts: end_val = total_posts
+        if start_val > end_val:
+            print("Start must be <= End.")
+            return
+
+        # Calculate slice (List is Newest(0) -> Oldest(N-1))
+        slice_start = total_posts - end_val
+        slice_end = total_posts - start_val + 1
     
-    posts_to_download = all_posts[slice_start:slice_end]
+        posts_to_download = all_posts[slice_start:slice_end]
     
-    scraper.download_posts(posts_to_download, output_dir, skip_podcasts=args.skip_podcasts, html_only=args.html_only, md_only=args.md_only)
+        scraper.download_posts(posts_to_download, output_dir, skip_podcasts=args.skip_podcasts, html_only=args.html_only, md_only=args.md_only)
+    finally:
+        scraper.close()
+        if scraper.search_index:
+            scraper.search_index.close()
+        if args.report or args.prom_file:
+            scraper.write_run_report(args.report, args.prom_file, newsletter=domain)
 
 if __name__ == "__main__":
     main()
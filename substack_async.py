@@ -0,0 +1,426 @@
+"""Async library API for using the scraper from other programs.
+
+    import asyncio
+    from substack_async import SubstackClient, JsonlSink
+
+    async def main():
+        async with SubstackClient("https://read.substack.com", session_file="substack_session.json") as client:
+            async for post in client.posts(since="2024-01-01"):
+                print(post.title, len(post.body_html))
+
+            # Or hand every post to one or more sinks
+            await client.run(JsonlSink("posts.jsonl"), since="2024-01-01")
+
+    asyncio.run(main())
+
+Nothing here prints or draws progress bars. Failures surface as SubstackError, either
+raised from the iterator (errors="raise", the default) or collected in client.errors and
+passed to an on_error callback (errors="collect"). Requests go through the same rate
+limiter, retries, raw cache and asset store as the command line scraper, on a thread pool.
+"""
+
+import os
+import json
+import asyncio
+import inspect
+import weakref
+from dataclasses import dataclass, field, asdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import requests
+
+from scraper import SubstackScraper, Manifest, render_post, scan_image_sources
+
+_DONE = object()
+
+
+class SubstackError(Exception):
+    """A failed archive, post, transcript or sink step, with enough context to log or retry it."""
+
+    def __init__(self, message, stage, slug=None, url=None, status=None):
+        super().__init__(message)
+        self.message = message
+        # 'session', 'archive', 'post', 'transcript' or 'sink'
+        self.stage = stage
+        self.slug = slug
+        self.url = url
+        # HTTP status code, when the server answered
+        self.status = status
+
+    @classmethod
+    def from_exception(cls, exc, stage, slug=None, url=None):
+        response = getattr(exc, 'response', None)
+        status = response.status_code if response is not None else None
+        return cls(str(exc), stage, slug=slug, url=url or (response.url if response is not None else None), status=status)
+
+    def to_dict(self):
+        return {'message': self.message, 'stage': self.stage, 'slug': self.slug, 'url': self.url, 'status': self.status}
+
+
+@dataclass
+class AssetRef:
+    """An image or audio file referenced by a post."""
+
+    kind: str
+    # URL as it appears in the post
+    source: str
+    # URL that was (or would be) downloaded; a resized variant when image_width is set
+    url: str
+    # 'assets/<file>' relative to output_dir, once downloaded
+    path: Optional[str] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class PostRecord:
+    """A post as returned by the API, plus its transcript and asset references."""
+
+    slug: str
+    title: str
+    url: str
+    id: Optional[int] = None
+    subtitle: Optional[str] = None
+    post_date: Optional[str] = None
+    updated_at: Optional[str] = None
+    type: Optional[str] = None
+    audience: Optional[str] = None
+    body_html: str = ''
+    transcript_html: Optional[str] = None
+    assets: List[AssetRef] = field(default_factory=list)
+    # The full API response
+    raw: dict = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_api(cls, post, base_url, transcript_html=None, assets=None):
+        return cls(
+            slug=post.get('slug'),
+            title=post.get('title') or 'Untitled',
+            url=post.get('canonical_url') or f"{base_url}/p/{post.get('slug')}",
+            id=post.get('id'),
+            subtitle=post.get('subtitle'),
+            post_date=post.get('post_date'),
+            updated_at=post.get('updated_at'),
+            type=post.get('type'),
+            audience=post.get('audience'),
+            body_html=post.get('body_html') or '',
+            transcript_html=transcript_html,
+            assets=assets or [],
+            raw=post,
+        )
+
+    def to_dict(self, include_raw=False):
+        data = asdict(self)
+        if not include_raw:
+            del data['raw']
+        return data
+
+
+class JsonlSink:
+    """Append each post to a JSON Lines file."""
+
+    def __init__(self, path, include_raw=False):
+        self.path = path
+        self.include_raw = include_raw
+        self._file = None
+
+    def write(self, record):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(record.to_dict(include_raw=self.include_raw)) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+class DirectorySink:
+    """Render posts to HTML/Markdown files, in the same layout (and manifest) as the command line scraper.
+
+    Local image and audio links are used for assets the client downloaded
+    (download_assets=True with the same output_dir); others keep their remote URLs.
+    """
+
+    def __init__(self, output_dir, html_only=False, md_only=False):
+        self.output_dir = output_dir
+        self.html_only = html_only
+        self.md_only = md_only
+        self._client = None
+        self._manifest = None
+
+    def open(self, client):
+        self._client = client
+        self._manifest = Manifest(self.output_dir)
+
+    async def write(self, record):
+        await self._client._run(self._write, record)
+
+    def _write(self, record):
+        scraper = self._client.scraper
+        job = scraper.parse_post(record.raw, self.output_dir)
+        if not job:
+            return
+        image_map = {asset.source: asset.path for asset in record.assets if asset.kind == 'image' and asset.path}
+        audio = [asset.path for asset in record.assets if asset.kind == 'audio' and asset.path]
+        audio_filename = os.path.basename(audio[0]) if audio else None
+        scraper._attach_assets(job, image_map, audio_filename, record.transcript_html)
+        files = render_post(job, scraper.base_url, html_only=self.html_only, md_only=self.md_only)
+        self._manifest.record(record.raw, files, job['assets'], job['image_map'])
+
+    def close(self):
+        if self._manifest:
+            # Index pages and feed cover whatever was saved, even if the stream stopped early
+            self._client.scraper.update_index(self._manifest, self.output_dir)
+            self._manifest.close()
+            self._manifest = None
+
+
+class SubstackClient:
+    """Async, side-effect free access to one newsletter.
+
+    posts() yields PostRecords as they are fetched. At most `concurrency` posts are in
+    flight, and no more than queue_size finished posts wait for the consumer, so a slow
+    consumer slows fetching down instead of filling memory.
+    """
+
+    def __init__(self, base_url, cookie=None, session_file=None, concurrency=4, queue_size=8,
+                 download_assets=False, output_dir=None, image_width=None, transcripts=True,
+                 rate=2.0, asset_rate=20.0, retries=5, raw_cache_dir=None, errors="raise", on_error=None, transport="http1"):
+        if download_assets and not output_dir:
+            raise ValueError("download_assets needs an output_dir")
+        if errors not in ("raise", "collect"):
+            raise ValueError("errors must be 'raise' or 'collect'")
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(1, queue_size)
+        self.download_assets = download_assets
+        self.output_dir = output_dir
+        self.transcripts = transcripts
+        self.errors_mode = errors
+        self.on_error = on_error
+        # Errors seen so far (only filled with errors="collect")
+        self.errors = []
+        self.scraper = SubstackScraper(
+            base_url,
+            cookie,
+            fetch_workers=self.concurrency,
+            rate=rate,
+            asset_rate=asset_rate,
+            retries=retries,
+            raw_cache_dir=raw_cache_dir,
+            image_width=image_width,
+            transport=transport,
+        )
+        if session_file and not cookie:
+            try:
+                self.scraper.apply_session_file(session_file)
+            except (OSError, ValueError, KeyError) as e:
+                raise SubstackError(f"Could not load session file: {e}", 'session', url=session_file) from e
+        # Post fetches, plus room for their image downloads
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency + self.scraper.image_workers)
+        # posts() streams not yet exhausted; closed (stopping their work) by close()
+        self._streams = weakref.WeakSet()
+
+    @property
+    def base_url(self):
+        return self.scraper.base_url
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        for stream in list(self._streams):
+            await stream.aclose()
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+        self.scraper.close()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _report(self, error):
+        if self.errors_mode == "raise":
+            raise error
+        self.errors.append(error)
+        if self.on_error:
+            self.on_error(error)
+
+    async def get_post(self, slug):
+        """Fetch one post (with its transcript and assets) as a PostRecord. Raises SubstackError."""
+        try:
+            post = await self._run(self.scraper.fetch_post, slug)
+        except requests.exceptions.RequestException as e:
+            raise SubstackError.from_exception(e, 'post', slug=slug) from e
+        except ValueError as e:
+            raise SubstackError(f"Invalid JSON for post {slug}: {e}", 'post', slug=slug) from e
+
+        transcript_html = None
+        is_podcast = post.get('type') == 'podcast'
+        if is_podcast and self.transcripts:
+            try:
+                transcript = await self._run(self.scraper.fetch_transcript, slug)
+            except requests.exceptions.RequestException as e:
+                raise SubstackError.from_exception(e, 'transcript', slug=slug) from e
+            transcript_html = transcript.get('body_html') if transcript else None
+
+        assets = await self._assets(post)
+        return PostRecord.from_api(post, self.base_url, transcript_html=transcript_html, assets=assets)
+
+    async def _assets(self, post):
+        image_sources, srcsets = scan_image_sources(post.get('body_html') or '')
+        assets = []
+        for src in dict.fromkeys(image_sources):
+            url, _key = self.scraper._image_request(src, srcsets.get(src))
+            assets.append(AssetRef('image', src, url))
+        if post.get('audio_url'):
+            assets.append(AssetRef('audio', post['audio_url'], post['audio_url']))
+        if not self.download_assets:
+            return assets
+
+        assets_dir = os.path.join(self.output_dir, "assets")
+
+        async def fetch(asset):
+            try:
+                if asset.kind == 'image':
+                    filename = await self._run(self.scraper.fetch_image, asset.source, assets_dir, srcsets.get(asset.source))
+                else:
+                    filename = await self._run(self.scraper.fetch_audio, asset.url, assets_dir)
+                asset.path = f"assets/{filename}"
+            except Exception as e:
+                # A missing image shouldn't lose the post; the reference records what went wrong
+                asset.error = str(e)
+
+        await asyncio.gather(*(fetch(asset) for asset in assets))
+        return assets
+
+    def posts(self, slugs=None, since=None, until=None, search='', limit=None, skip_podcasts=False):
+        """Return an async iterator of PostRecords, newest first (or in the order of slugs).
+
+        since/until are inclusive 'YYYY-MM-DD' dates; archive paging stops at the first post
+        older than since. Outstanding work stops when the iterator is closed: leaving the
+        client's async with block does that, or use contextlib.aclosing() to stop right away.
+        """
+        stream = self._posts(slugs, since, until, search, limit, skip_podcasts)
+        self._streams.add(stream)
+        return stream
+
+    async def _posts(self, slugs, since, until, search, limit, skip_podcasts):
+        summaries = asyncio.Queue(maxsize=self.queue_size)
+        results = asyncio.Queue(maxsize=self.queue_size)
+        archive = {'iterator': None, 'future': None}
+        # Posts finish out of order; each carries its sequence number and waits in a reorder
+        # buffer until the ones before it are out. The window caps how far fetching can run
+        # ahead of the oldest unfinished post, so the buffer stays bounded too.
+        window = asyncio.Semaphore(self.concurrency + self.queue_size)
+
+        async def next_summary():
+            # Archive pages are fetched by a blocking generator; step it on the thread pool
+            if archive['iterator'] is None:
+                archive['iterator'] = self.scraper.iter_archive(search=search, since=since, until=until, strict=True)
+            archive['future'] = self._executor.submit(next, archive['iterator'], None)
+            return await asyncio.wrap_future(archive['future'])
+
+        async def feed():
+            # Every failure is turned into a result, so the consumer always sees the end of the stream.
+            # (No finally: a cancelled task must not block on a full queue.)
+            count = 0
+            pending = list(slugs) if slugs else None
+            while not limit or count < limit:
+                if pending is not None:
+                    if not pending:
+                        break
+                    summary = {'slug': pending.pop(0)}
+                else:
+                    try:
+                        summary = await next_summary()
+                    except Exception as e:
+                        await window.acquire()
+                        await results.put((count, SubstackError.from_exception(e, 'archive')))
+                        break
+                    if summary is None:
+                        break
+                is_podcast = summary.get('type') == 'podcast' or summary.get('podcast_url') is not None
+                if not summary.get('slug') or (skip_podcasts and is_podcast):
+                    continue
+                await window.acquire()
+                await summaries.put((count, summary))
+                count += 1
+            for _ in range(self.concurrency):
+                await summaries.put(_DONE)
+
+        async def work():
+            while True:
+                item = await summaries.get()
+                if item is _DONE:
+                    break
+                seq, summary = item
+                try:
+                    record = await self.get_post(summary['slug'])
+                except SubstackError as e:
+                    record = e
+                except Exception as e:
+                    record = SubstackError(str(e), 'post', slug=summary['slug'])
+                await results.put((seq, record))
+            await results.put(_DONE)
+
+        tasks = [asyncio.create_task(feed())] + [asyncio.create_task(work()) for _ in range(self.concurrency)]
+        finished = 0
+        pending = {}
+        next_seq = 0
+        try:
+            while finished < self.concurrency:
+                item = await results.get()
+                if item is _DONE:
+                    finished += 1
+                    continue
+                seq, record = item
+                pending[seq] = record
+                while next_seq in pending:
+                    record = pending.pop(next_seq)
+                    next_seq += 1
+                    window.release()
+                    if isinstance(record, SubstackError):
+                        self._report(record)
+                    else:
+                        yield record
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if archive['iterator'] is not None:
+                # Let an in-flight page finish before closing the generator (it can't be closed while running)
+                if archive['future'] is not None and not archive['future'].done():
+                    await asyncio.gather(asyncio.wrap_future(archive['future']), return_exceptions=True)
+                archive['iterator'].close()
+
+    async def run(self, *sinks, **filters):
+        """Send every post to each sink and return {'posts': n, 'errors': n}.
+
+        A sink is an object with write(record) (plain or async) and optional open(client)
+        and close() methods, or just a callable. filters are passed to posts().
+        """
+        for sink in sinks:
+            if hasattr(sink, 'open'):
+                sink.open(self)
+        count = 0
+        errors_before = len(self.errors)
+        try:
+            async for record in self.posts(**filters):
+                for sink in sinks:
+                    write = sink.write if hasattr(sink, 'write') else sink
+                    try:
+                        result = write(record)
+                        if inspect.isawaitable(result):
+                            await result
+                    except Exception as e:
+                        self._report(SubstackError(f"{type(sink).__name__} failed: {e}", 'sink', slug=record.slug, url=record.url))
+                count += 1
+        finally:
+            for sink in sinks:
+                if hasattr(sink, 'close'):
+                    sink.close()
+        return {'posts': count, 'errors': len(self.errors) - errors_before}